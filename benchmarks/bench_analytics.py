@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+compare computing receivables from a list of dicts with a loop, and from columns with the analytics module
+
+Both start from the decoded JSON of an invoice list; the time includes the
+conversion of the fields (to dicts with get's types, or to columns).
+
+usage: python benchmarks/bench_analytics.py [number of invoices]
+"""
+from datetime import datetime, timedelta
+import json
+import random
+import sys
+import time
+import factuursturen
+from factuursturen import analytics
+
+
+def make_invoices(count):
+    """build a JSON payload with invoices, as returned by the API"""
+    start = datetime(2013, 1, 1)
+    invoices = []
+    for number in xrange(count):
+        sent = start + timedelta(days=random.randint(0, 365))
+        paid = random.random() < 0.7
+        invoices.append({'invoicenr': str(number),
+                         'clientnr': str(random.randint(1, 2000)),
+                         'sent': sent.strftime('%Y-%m-%d'),
+                         'duedate': (sent + timedelta(days=30)).strftime('%Y-%m-%d'),
+                         'paiddate': (sent + timedelta(days=random.randint(1, 90))).strftime('%Y-%m-%d')
+                                     if paid else '',
+                         'open': '0' if paid else '{:.2f}'.format(random.uniform(10, 1000))})
+    return json.dumps(invoices)
+
+
+def with_loop(fact, payload, today):
+    """the straightforward way: a loop over the dicts of get"""
+    invoices = fact._convertstringfields_in_list_of_dicts(fact._json_loads(payload), 'invoices', 'fromstring')
+    totals = {}
+    buckets = dict((label, 0.0) for label in analytics._bucket_labels(analytics.AGINGBOUNDS))
+    days = []
+    for invoice in invoices:
+        if invoice['open']:
+            totals[invoice['clientnr']] = totals.get(invoice['clientnr'], 0.0) + invoice['open']
+            overdue = (today - invoice['duedate']).days
+            if overdue <= 0:
+                buckets['current'] += invoice['open']
+            elif overdue <= 30:
+                buckets['1-30'] += invoice['open']
+            elif overdue <= 60:
+                buckets['31-60'] += invoice['open']
+            elif overdue <= 90:
+                buckets['61-90'] += invoice['open']
+            else:
+                buckets['90+'] += invoice['open']
+        if invoice['paiddate'] is not None:
+            days.append((invoice['paiddate'] - invoice['sent']).days)
+    return totals, buckets, days
+
+
+def with_columns(fact, payload, today):
+    """the analytics module over columns"""
+    columns = fact._convert_to_columns(fact._json_loads(payload), 'invoices')
+    return (analytics.open_per_client(columns), analytics.aging(columns, today),
+            analytics.days_to_pay(columns))
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    payload = make_invoices(count)
+    today = datetime(2014, 1, 1)
+    fact = factuursturen.Client('foo', 'foo', json_backend='json')
+    for name, function in (('loop over dicts', with_loop), ('columns', with_columns)):
+        start = time.time()
+        function(fact, payload, today)
+        print "{:<16}: {} invoices in {:.3f}s".format(name, count, time.time() - start)
+    columns = fact._convert_to_columns(fact._json_loads(payload), 'invoices')
+    start = time.time()
+    analytics.open_per_client(columns)
+    analytics.aging(columns, today)
+    analytics.days_to_pay(columns)
+    print "{:<16}: {} invoices in {:.3f}s (aggregates only)".format('columns', count, time.time() - start)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+measure the memory taken by the strings of a 50k client list, with and without interning
+
+Only the string values of the fields in INTERNFIELDS['clients'] are counted;
+every distinct object is counted once.
+
+usage: python benchmarks/bench_intern.py [number of clients]
+"""
+import json
+import random
+import sys
+import time
+import factuursturen
+
+
+def make_clients(count):
+    """build a JSON payload with clients, as returned by the API"""
+    cities = ['Amsterdam', 'Rotterdam', 'Utrecht', 'Den Haag', 'Eindhoven', 'Groningen']
+    clients = []
+    for number in xrange(count):
+        clients.append({'clientnr': str(number),
+                        'company': 'Company {}'.format(number),
+                        'city': random.choice(cities),
+                        'country': random.choice(['146', '21', '81']),
+                        'sendmethod': random.choice(['email', 'mail', 'printcenter']),
+                        'paymentmethod': random.choice(['bank', 'autocollect', 'cash']),
+                        'showcontact': 'true',
+                        'top': '30'})
+    return json.dumps(clients)
+
+
+def string_bytes(clients):
+    """return total size of the distinct string objects in the interned fields"""
+    seen = {}
+    for client in clients:
+        for key in factuursturen.INTERNFIELDS['clients']:
+            value = client.get(key)
+            seen[id(value)] = sys.getsizeof(value)
+    return sum(seen.itervalues())
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    payload = make_clients(count)
+    for intern_strings in (False, True):
+        fact = factuursturen.Client('foo', 'foo', json_backend='json', intern_strings=intern_strings)
+        start = time.time()
+        clients = fact._convertstringfields_in_list_of_dicts(fact._json_loads(payload), 'clients', 'fromstring')
+        elapsed = time.time() - start
+        print "intern_strings={!s:<5}: {:10d} bytes in strings, decoded and converted in {:.3f}s".format(
+            intern_strings, string_bytes(clients), elapsed)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""
+compare the installed JSON backends on a large synthetic 'invoices' payload
+
+usage: python benchmarks/bench_json.py [number of invoices]
+"""
+import random
+import sys
+import timeit
+import factuursturen
+
+
+def make_invoices(count):
+    """build a list of invoices with string values, as returned by the API"""
+    invoices = []
+    for number in xrange(count):
+        invoices.append({'invoicenr': 'F{:06d}'.format(number),
+                         'clientnr': str(random.randint(1, 5000)),
+                         'profile': str(random.randint(1, 5)),
+                         'discount': '0.00',
+                         'paymentperiod': '30',
+                         'collection': random.choice(['true', 'false']),
+                         'tax': '{:.2f}'.format(random.uniform(0, 200)),
+                         'totalintax': '{:.2f}'.format(random.uniform(0, 1000)),
+                         'sent': '2013-{:02d}-{:02d}'.format(random.randint(1, 12), random.randint(1, 28)),
+                         'open': '{:.2f}'.format(random.uniform(0, 1000)),
+                         'paiddate': '',
+                         'duedate': '2014-01-31',
+                         'lastreminder': '',
+                         'company': 'Company {}'.format(number % 5000),
+                         'city': random.choice(['Amsterdam', 'Rotterdam', 'Utrecht'])})
+    return invoices
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    invoices = make_invoices(count)
+    for name in factuursturen.JSONBACKENDS:
+        try:
+            fact = factuursturen.Client('foo', 'foo', json_backend=name)
+        except factuursturen.FactuursturenWrongCall:
+            print "{:<12} not installed".format(name)
+            continue
+        payload = fact._json_dumps(invoices)
+        dumps = min(timeit.repeat(lambda: fact._json_dumps(invoices), number=1, repeat=3))
+        loads = min(timeit.repeat(lambda: fact._json_loads(payload), number=1, repeat=3))
+        print "{:<12} dumps {:8.3f}s  loads {:8.3f}s  ({} invoices, {} bytes)".format(name, dumps, loads,
+                                                                                      count, len(payload))
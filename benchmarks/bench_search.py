@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""
+compare type-ahead search over a client list by substring scan and with a SearchIndex
+
+Every prefix of each query is searched, as it would be while typing.
+
+usage: python benchmarks/bench_search.py [number of clients]
+"""
+import random
+import string
+import sys
+import time
+import factuursturen
+
+
+def make_clients(count):
+    """build clients with random company names, contacts and cities"""
+    cities = ['Amsterdam', 'Rotterdam', 'Utrecht', 'Den Haag', 'Eindhoven', 'Groningen']
+
+    def word():
+        return ''.join(random.choice(string.ascii_lowercase) for _ in range(random.randint(4, 9))).capitalize()
+
+    return [{'clientnr': number,
+             'company': '{} {} BV'.format(word(), word()),
+             'contact': '{} {}'.format(word(), word()),
+             'city': random.choice(cities)} for number in xrange(count)]
+
+
+def scan(clients, query):
+    """the straightforward way: a substring test on every client"""
+    query = query.lower()
+    return [client for client in clients
+            if query in ' '.join((client['company'], client['contact'], client['city'])).lower()][:10]
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    clients = make_clients(count)
+    queries = [client['company'].split()[0] for client in random.sample(clients, 50)]
+    prefixes = [query[:length] for query in queries for length in range(1, len(query) + 1)]
+
+    start = time.time()
+    index = factuursturen.SearchIndex('clients', clients)
+    print "built index of {} clients in {:.3f}s".format(count, time.time() - start)
+    for name, function in (('substring scan', lambda query: scan(clients, query)),
+                           ('trigram index', index.search)):
+        start = time.time()
+        for prefix in prefixes:
+            function(prefix)
+        print "{:<15}: {:.3f} ms per keystroke".format(name, (time.time() - start) * 1000 / len(prefixes))
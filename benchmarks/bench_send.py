@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+time the preparation of invoices with many lines for sending
+
+Compares the current single pass serializer with the former send path, which
+deep-copied the data and then converted, flattened and fixed the keys in
+three passes.
+
+usage: python benchmarks/bench_send.py [number of lines]
+"""
+import copy
+import sys
+import timeit
+from datetime import datetime
+import factuursturen
+
+
+def make_invoice(linecount):
+    """build a nested invoice as it would be passed to post()"""
+    lines = {}
+    for number in xrange(linecount):
+        lines['line{}'.format(number)] = {'amount': number % 10 + 1,
+                                          'amount_desc': 'pcs',
+                                          'description': 'Product number {}'.format(number),
+                                          'tax_rate': 21,
+                                          'price': 12.50,
+                                          'discount_pct': 0}
+    return {'clientnr': 123,
+            'reference': {'line1': 'Your ref: ABC123',
+                          'line2': 'Our ref: XZX0029'},
+            'lines': lines,
+            'action': 'send',
+            'sendmethod': 'email',
+            'collection': False,
+            'initialdate': datetime(2013, 12, 31)}
+
+
+def former_prepare(fact, invoice):
+    """the send preparation as it was done before the single pass serializer"""
+    adict = copy.deepcopy(invoice)
+    adict = fact._convertstringfields_in_dict(adict, 'invoices', 'tostring')
+    adict = fact._flatten(adict)
+    return fact._fixkeynames(adict)
+
+
+if __name__ == '__main__':
+    linecounts = [int(sys.argv[1])] if len(sys.argv) > 1 else [10, 100, 500]
+    fact = factuursturen.Client('foo', 'foo')
+    for linecount in linecounts:
+        invoice = make_invoice(linecount)
+        repeat = max(1, 20000 // linecount)
+        current = min(timeit.repeat(lambda: fact._prepare_for_send(invoice, 'invoices'),
+                                    number=repeat, repeat=3)) / repeat
+        former = min(timeit.repeat(lambda: former_prepare(fact, invoice),
+                                   number=repeat, repeat=3)) / repeat
+        print "{:5d} lines: {:9.1f}us per invoice (former: {:9.1f}us)".format(linecount,
+                                                                             current * 1e6,
+                                                                             former * 1e6)
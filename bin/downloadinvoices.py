@@ -2,9 +2,15 @@
 
 import argparse
 import os
-import errno
+import functools
 import logging
+import sys
+import threading
+import time
+import requests
 import factuursturen
+from factuursturen.download import (ArchiveWriter, BatchedWriter, Manifest, Progress, download, download_all,
+                                    in_shard, mkdir_p, next_poll, parse_shard, plan_windows)
 
 def do_options():
     """parse commandline options and get defaults from configfile
@@ -20,15 +26,47 @@ def do_options():
     parser.add_argument('-u', '--username', help='username from factuursturen.nl')
     parser.add_argument('-k', '--apikey', help='apikey from factuursturen.nl')
     parser.add_argument('-i', '--id', help='only download invoice(s) with this id(s)', action='append')
-    return parser.parse_args()
+    parser.add_argument('-w', '--workers', help='number of concurrent downloads', type=int, default=1)
+    parser.add_argument('-m', '--manifest', help='manifest of downloaded invoices (default: .manifest.sqlite '
+                                                 'in the directory)')
+    parser.add_argument('-f', '--force', help='download all invoices, also the ones that did not change',
+                        action='store_true')
+    parser.add_argument('-a', '--archive', help='write the invoices into an archive per year instead of separate '
+                                                'files', choices=['zip', 'tar'])
+    parser.add_argument('-n', '--dry-run', '--plan', help='only show what would be downloaded and how many hours '
+                                                          'of API calls that takes', action='store_true')
+    parser.add_argument('--hourly-limit', help='number of API calls allowed per hour (default: estimated from the '
+                                               'remaining calls)', type=int)
+    parser.add_argument('--wait', help='when the API calls are used up, wait this many seconds and continue '
+                                       '(0: stop)', type=int, default=300)
+    parser.add_argument('--shard', help='only download part I of N of the invoices (I from 1 to N), so N processes '
+                                        'can share the work', metavar='I/N', type=shard_type)
+    parser.add_argument('--shard-by', help='divide invoices over the shards by hash of the invoice number, or by '
+                                           'year (needed with --archive)', choices=['hash', 'year'], default='hash')
+    parser.add_argument('-W', '--watch', help='keep running, and download new or changed invoices as they appear',
+                        action='store_true')
+    parser.add_argument('--interval', help='with --watch, the shortest time in seconds between listing the invoices',
+                        type=int, default=60)
+    parser.add_argument('--max-interval', help='with --watch, the longest time in seconds between listing the '
+                                               'invoices', type=int, default=3600)
+    parser.add_argument('-p', '--progress', help='report progress every this many seconds', type=int, default=0)
+    parser.add_argument('-s', '--sync-every', help='sync written files to disk per this many files '
+                                                   '(0: leave it to the operating system)', type=int, default=50)
+    arguments = parser.parse_args()
+    if arguments.archive and arguments.shard and arguments.shard_by != 'year':
+        # processes sharing an archive would overwrite each other's additions
+        parser.error('--archive with --shard needs --shard-by year, so every archive has one writer')
+    return arguments
 
-def mkdir_p(dirname):
+def shard_type(value):
+    """parse a shard option like '2/4' into (2, 4)
+
+    :param value: string from the commandline
+    """
     try:
-        os.makedirs(dirname)
-    except OSError as exc: # Python >2.5
-        if exc.errno == errno.EEXIST and os.path.isdir(dirname):
-            pass
-        else: raise
+        return parse_shard(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
 
 def setLogger(options):
     """set up a logfile
@@ -40,6 +78,9 @@ def setLogger(options):
         loglevel = logging.getLevelName(loglevel) - 10 * options.verbose
         if loglevel < 10:
             loglevel = 10
+    if options.progress and logging.getLevelName(loglevel) > logging.INFO:
+        # progress and the summary are logged as info
+        loglevel = logging.INFO
 
     logger = logging.getLogger('main')
     logger.setLevel(loglevel)
@@ -55,45 +96,211 @@ def setLogger(options):
 
     return logger
 
-if __name__ == '__main__':
-    arguments = do_options()
-    logger = setLogger(arguments)
+def invoice_filename(arguments, invoice):
+    """return the filename to save an invoice in
 
-    mkdir_p(arguments.directory)
+    in archive mode, the filename is the name of the archive of the year, followed by the member name
 
-    fact = factuursturen.Client(apikey=arguments.apikey, username=arguments.username)
-    logger.debug("using username {}".format(fact._username))
+    :param arguments: parsed options
+    :param invoice: invoice dict as returned by the API
+    """
+    invoicenr = invoice[u'invoicenr']
+    invoicefilename = invoicenr.replace('/','_')
+    year = invoice[u'sent'].year
+    if arguments.archive:
+        return '{}/{}.{}/{}.pdf'.format(arguments.directory, year, arguments.archive, invoicefilename)
+    elif arguments.year:
+        return '{}/{}/{}.pdf'.format(arguments.directory, year, invoicefilename)
+    else:
+        return '{}/{}.pdf'.format(arguments.directory, invoicenr)
+
+class Reporter(threading.Thread):
+    """
+    thread that reports progress periodically
+
+    On a terminal the status line is updated in place; otherwise (or when
+    logging to a file) a line is logged every time.
+    """
+
+    def __init__(self, progress, interval, logger, tty):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._progress = progress
+        self._interval = interval
+        self._logger = logger
+        self._tty = tty
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            self.report()
+
+    def report(self):
+        """report the current status"""
+        if self._tty:
+            sys.stderr.write('\r' + self._progress.status() + '\033[K')
+            sys.stderr.flush()
+        else:
+            self._logger.info(self._progress.status())
+
+    def stop(self):
+        """stop reporting, ending with the final status"""
+        self._stopped.set()
+        self.join()
+        self.report()
+        if self._tty:
+            sys.stderr.write('\n')
+
+def show_plan(planned, fact, arguments):
+    """print what would be downloaded, and how the calls fit in the rate limit
+
+    :param planned: list of (invoicenr, filename) tuples that would be downloaded
+    :param fact: factuursturen.Client, after listing the invoices
+    :param arguments: parsed options
+    """
+    for invoicenr, filename in planned:
+        print "{} -> {}".format(invoicenr, filename)
+    remaining = fact.remaining if fact.remaining is not None else 0
+    print "{} invoices to download, {} API calls remaining this hour".format(len(planned), remaining)
+    if arguments.hourly_limit is None and remaining <= 0:
+        # the calls left tell nothing about the calls allowed per hour
+        print "no API calls remaining, use --hourly-limit to plan"
+        return
+    # the listing of the invoices used one call of the current window
+    limit = arguments.hourly_limit or remaining + 1
+    if limit <= 0:
+        print "no API calls allowed, cannot plan"
+        return
+    windows = plan_windows(len(planned), remaining, limit)
+    if len(windows) == 1:
+        print "fits in the current hour"
+    else:
+        print "needs {} hours (up to {} calls per hour):".format(len(windows), limit)
+        for hour, calls in enumerate(windows):
+            print "  hour {}: {} invoices".format(hour, calls)
 
+def plan_downloads(fact, manifest, writer, progress, arguments, logger):
+    """list the invoices and return the downloads to make
+
+    returns (jobs, planned): jobs as used by download_all, planned a list of
+    (invoicenr, filename) tuples
+
+    :param fact: factuursturen.Client
+    :param manifest: Manifest
+    :param writer: BatchedWriter or ArchiveWriter
+    :param progress: Progress
+    :param arguments: parsed options
+    :param logger: logger
+    """
+    start = time.time()
     invoices = fact.get('invoices')
+    progress.called()
+    progress.add('listing', time.time() - start)
     logger.debug("got {} invoices from API".format(len(invoices)))
 
+    start = time.time()
+    jobs = []
+    planned = []
     for invoice in invoices:
         invoicenr = invoice[u'invoicenr']
-        invoicefilename = invoicenr.replace('/','_')
-        year = invoice[u'sent'].year
+        if not in_shard(invoice, arguments.shard, arguments.shard_by):
+            continue
         if arguments.id is None or invoicenr in arguments.id:
-            logger.debug("invoice {} from year {}".format(invoicenr, year))
-            if arguments.year:
-                mkdir_p('{}/{}'.format(arguments.directory, year))
-                filename = '{}/{}/{}.pdf'.format(arguments.directory, year, invoicefilename)
-            else:
-                filename = '{}/{}.pdf'.format(arguments.directory, invoicenr)
+            logger.debug("invoice {} from year {}".format(invoicenr, invoice[u'sent'].year))
+            filename = invoice_filename(arguments, invoice)
             logger.debug("filename: {}".format(filename))
-            #if not os.path.exists(filename):
-            if 1:
-                try:
-                    logger.debug("trying to get invoice {}".format(invoicenr))
-                    pdf = fact.get('invoices_pdf', invoicenr)
-                    with open(filename, 'w') as f:
-                        f.write(pdf)
-                    logger.debug("written file {}".format(filename))
-                except factuursturen.FactuursturenEmptyResult:
-                    logger.debug("factuur {} is empty".format(invoicenr))
-                except factuursturen.FactuursturenNotFound:
-                    logger.error("invoice {} not found".format(invoicenr))
-                except factuursturen.FactuursturenNoMoreApiCalls:
-                    logger.error("no more remaining API calls")
-                finally:
-                    logger.debug("API calls remaining: {}".format(fact.remaining))
+            if arguments.force or not manifest.is_current(invoice, filename, writer):
+                planned.append((invoicenr, filename))
+                jobs.append((invoicenr, functools.partial(download, fact, invoice, filename, manifest, writer,
+                                                          progress, logger)))
             else:
-                logger.debug("file exists.")
+                logger.debug("file exists and invoice did not change.")
+    progress.add('conversion', time.time() - start)
+    progress.total += len(jobs)
+    return jobs, planned
+
+def watch(fact, manifest, writer, progress, arguments, logger):
+    """keep polling for new or changed invoices and download them, until interrupted
+
+    All polls use the same client, so its connections stay open between them.
+    A poll that fails (like a network or server error) is logged and counts as
+    a poll without new invoices, so the next one waits longer.
+
+    :param fact: factuursturen.Client
+    :param manifest: Manifest
+    :param writer: BatchedWriter or ArchiveWriter
+    :param progress: Progress
+    :param arguments: parsed options
+    :param logger: logger
+    """
+    interval = arguments.interval
+    try:
+        while True:
+            try:
+                jobs, planned = plan_downloads(fact, manifest, writer, progress, arguments, logger)
+            except factuursturen.FactuursturenNoMoreApiCalls:
+                logger.warning("no more remaining API calls, cannot list the invoices")
+                fact._remaining = 0
+                jobs, planned = [], []
+            except (factuursturen.FactuursturenError, requests.RequestException, ValueError) as error:
+                # ValueError: a response that is not JSON
+                logger.error("cannot list the invoices: {}".format(error))
+                jobs, planned = [], []
+            if jobs:
+                logger.info("{} new or changed invoices".format(len(jobs)))
+                download_all(fact, jobs, writer, progress, logger, arguments.workers, arguments.wait)
+            interval = next_poll(interval, len(jobs), fact.remaining, arguments.interval, arguments.max_interval,
+                                 arguments.wait)
+            logger.debug("next poll in {:.0f} seconds".format(interval))
+            time.sleep(interval)
+            if fact.remaining is not None and fact.remaining <= 0:
+                # unknown until the next call tells
+                fact._remaining = None
+    except KeyboardInterrupt:
+        logger.info("stopped watching")
+
+if __name__ == '__main__':
+    arguments = do_options()
+    logger = setLogger(arguments)
+
+    if not arguments.dry_run:
+        mkdir_p(arguments.directory)
+    manifest = Manifest(arguments.manifest or os.path.join(arguments.directory, '.manifest.sqlite'),
+                        readonly=arguments.dry_run)
+    if arguments.archive:
+        writer = ArchiveWriter(arguments.archive, arguments.sync_every, readonly=arguments.dry_run)
+    else:
+        writer = BatchedWriter(arguments.sync_every)
+
+    fact = factuursturen.Client(apikey=arguments.apikey, username=arguments.username,
+                                pool_size=arguments.workers)
+    logger.debug("using username {}".format(fact._username))
+    progress = Progress(fact)
+
+    if arguments.dry_run:
+        jobs, planned = plan_downloads(fact, manifest, writer, progress, arguments, logger)
+        show_plan(planned, fact, arguments)
+        manifest.close()
+        sys.exit(0)
+
+    failed = 0
+    reporter = None
+    if arguments.progress:
+        reporter = Reporter(progress, arguments.progress, logger,
+                            sys.stderr.isatty() and not arguments.logfile)
+        reporter.start()
+    try:
+        if arguments.watch:
+            watch(fact, manifest, writer, progress, arguments, logger)
+        else:
+            jobs, planned = plan_downloads(fact, manifest, writer, progress, arguments, logger)
+            failed = download_all(fact, jobs, writer, progress, logger, arguments.workers, arguments.wait)
+    finally:
+        if reporter is not None:
+            reporter.stop()
+    for line in progress.summary():
+        logger.info(line)
+    manifest.close()
+    if failed:
+        logger.error("{} invoices not downloaded".format(failed))
+        sys.exit(1)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+import argparse
+import csv
+import itertools
+import json
+import logging
+import factuursturen
+
+def do_options():
+    """parse commandline options
+
+    """
+    description = "Import products or clients into factuursturen from a CSV or JSONL file"
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-f', '--file', help='CSV or JSONL file to import', required=True)
+    parser.add_argument('-t', '--type', help='kind of records in the file', choices=['products', 'clients'],
+                        required=True)
+    parser.add_argument('--format', help='format of the file (default: guessed from the extension)',
+                        choices=['csv', 'jsonl'])
+    parser.add_argument('-m', '--map', help='use COLUMN from the file for API field FIELD (default: all columns, '
+                                            'named like the API fields)', metavar='FIELD=COLUMN', action='append')
+    parser.add_argument('-i', '--id-column', help='column holding the id of existing records; rows with an id are '
+                                                  'updated instead of created')
+    parser.add_argument('-w', '--workers', help='number of concurrent API calls', type=int, default=4)
+    parser.add_argument('-q', '--queue', help='number of rows read ahead (default: 4 per worker)', type=int)
+    parser.add_argument('-j', '--journal', help='journal file; when given, an interrupted import can be restarted '
+                                                'without sending rows twice')
+    parser.add_argument('-v', '--verbose', help='debuglevel', action='count')
+    parser.add_argument('-l', '--logfile', help='logile (none for terminal')
+    parser.add_argument('-u', '--username', help='username from factuursturen.nl')
+    parser.add_argument('-k', '--apikey', help='apikey from factuursturen.nl')
+    return parser.parse_args()
+
+def setLogger(options):
+    """set up a logfile
+
+    :param options: parsed options
+    """
+    loglevel = 'WARNING'
+    if options.verbose:
+        loglevel = logging.getLevelName(loglevel) - 10 * options.verbose
+        if loglevel < 10:
+            loglevel = 10
+
+    logger = logging.getLogger('main')
+    logger.setLevel(loglevel)
+    formatter = logging.Formatter('%(asctime)s [%(levelname)s]: %(message)s')
+
+    if options.logfile:
+        file_logger = logging.FileHandler(options.logfile)
+    else:
+        file_logger = logging.StreamHandler()
+    file_logger.setLevel(loglevel)
+    file_logger.setFormatter(formatter)
+    logger.addHandler(file_logger)
+
+    return logger
+
+def read_rows(filename, fileformat):
+    """yield the rows of a CSV or JSONL file as dicts, one at a time
+
+    :param filename: name of the file
+    :param fileformat: 'csv' or 'jsonl'
+    """
+    if fileformat == 'csv':
+        with open(filename, 'rb') as f:
+            for row in csv.DictReader(f):
+                yield row
+    else:
+        with open(filename, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def map_row(fact, function, row, mapping, id_column):
+    """return the record to send for a row of the file, and the id to update (or None)
+
+    values are converted to the types in CONVERTABLEFIELDS; empty values are left out
+
+    :param fact: factuursturen.Client
+    :param function: 'products' or 'clients'
+    :param row: dict read from the file
+    :param mapping: list of (field, column) tuples, or None to use all columns as they are named
+    :param id_column: column holding the id of an existing record, or None
+    """
+    if mapping is None:
+        mapping = [(column, column) for column in row if column != id_column]
+    record = {}
+    for field, column in mapping:
+        value = row.get(column)
+        if value is None or value == '':
+            continue
+        record[field] = value
+    objId = row.get(id_column) if id_column else None
+    return fact.convert_fields(function, record), objId or None
+
+def import_rows(fact, arguments, logger):
+    """read, check and send all rows of the file
+
+    The rows are read as the workers of Client.send_many need them, so memory
+    use does not depend on the size of the file.
+
+    returns a dict with counts of created, updated and failed rows, and of the
+    rows that were skipped because they were done in an earlier run (these are
+    counted as created or updated as well)
+
+    :param fact: factuursturen.Client
+    :param arguments: parsed options
+    :param logger: logger
+    """
+    function = arguments.type
+    fileformat = arguments.format or ('jsonl' if arguments.file.endswith(('.jsonl', '.json')) else 'csv')
+    mapping = [tuple(item.split('=', 1)) for item in arguments.map] if arguments.map else None
+    journal = factuursturen.Journal(arguments.journal) if arguments.journal else None
+    counts = {'created': 0, 'updated': 0, 'skipped': 0, 'failed': 0}
+    # row number and verb of the items handed to send_many, by their position
+    rows = {}
+    positions = itertools.count()
+    invalid = [0]
+
+    def items():
+        for rownumber, row in enumerate(read_rows(arguments.file, fileformat), 1):
+            try:
+                record, objId = map_row(fact, function, row, mapping, arguments.id_column)
+            except factuursturen.FactuursturenError as error:
+                invalid[0] += 1
+                logger.error("row {}: {}".format(rownumber, error))
+                continue
+            rows[next(positions)] = (rownumber, 'created' if objId is None else 'updated')
+            yield objId, record
+
+    outcomes = fact.send_many(function, items(), arguments.workers, journal, arguments.queue)
+    try:
+        for position, result in outcomes:
+            rownumber, outcome = rows.pop(position)
+            if isinstance(result, factuursturen.FactuursturenNoMoreApiCalls):
+                counts['failed'] += 1
+                logger.error("no more remaining API calls, stopping at row {}".format(rownumber))
+                break
+            if isinstance(result, factuursturen.FactuursturenError):
+                counts['failed'] += 1
+                logger.error("row {}: {}".format(rownumber, result))
+            else:
+                counts[outcome] += 1
+                logger.debug("row {} sent".format(rownumber))
+    finally:
+        # stops the workers before the journal is closed
+        outcomes.close()
+        if journal is not None:
+            journal.close()
+    counts['failed'] += invalid[0]
+    counts['skipped'] = fact.bulkstats['skipped']
+    return counts
+
+if __name__ == '__main__':
+    arguments = do_options()
+    logger = setLogger(arguments)
+
+    fact = factuursturen.Client(apikey=arguments.apikey, username=arguments.username,
+                                pool_size=arguments.workers)
+    logger.debug("using username {}".format(fact._username))
+
+    counts = import_rows(fact, arguments, logger)
+    print "{created} created, {updated} updated, {failed} failed ({skipped} done in an earlier run)".format(**counts)
+    logger.debug("API calls remaining: {}".format(fact.remaining))
@@ -3,14 +3,31 @@
 a class to access the REST API of the website www.factuursturen.nl
 
 """
+import array
 import collections
 import ConfigParser
 from datetime import datetime, date
+import functools
+import hashlib
+import importlib
+import json
 import re
 import requests
+import os
 from os.path import expanduser
-import copy
+import Queue
+import threading
+import time
 import urllib
+from factuursturen.indexed import IndexedList
+from factuursturen.journal import Journal
+from factuursturen.mirror import Mirror
+from factuursturen.search import SearchIndex
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 __author__ = 'Reinoud van Leeuwen'
 __copyright__ = "Copyright 2013, Reinoud van Leeuwen"
@@ -71,6 +88,37 @@ CONVERTABLEFIELDS = {
               'default': 'bool'}
 }
 
+# string fields whose values repeat a lot across records. When interning is
+# switched on (see Client), equal values in these fields share one object
+INTERNFIELDS = {
+    'clients': ['country', 'city', 'sendmethod', 'paymentmethod'],
+    'invoices': ['country', 'city', 'sendmethod', 'paymentmethod', 'action'],
+    'invoices_saved': ['sendmethod', 'paymentmethod'],
+    'invoices_repeated': ['sendmethod', 'paymentmethod', 'frequency'],
+    'profiles': ['name'],
+}
+
+# fields that have to be present when posting or putting
+REQUIREDFIELDS = {
+    'clients': ['contact'],
+    'products': ['code', 'name', 'price', 'taxes'],
+    'invoices': ['clientnr', 'lines', 'action'],
+    'invoices_payment': ['date'],
+}
+
+# fields of a single invoice line, with their required fields
+LINEFIELDS = {'amount': 'float',
+              'tax_rate': 'int',
+              'price': 'float',
+              'discount_pct': 'float'}
+REQUIREDLINEFIELDS = ['amount', 'description', 'tax_rate', 'price']
+
+# python types accepted for the types in CONVERTABLEFIELDS when sending
+VALIDATIONTYPES = {'int': (int, long),
+                   'float': (int, long, float),
+                   'bool': (bool, int),
+                   'date': (datetime,)}
+
 API = {'getters' : ['clients',
                     'products',
                     'invoices',
@@ -93,6 +141,17 @@ API = {'getters' : ['clients',
                      'invoices_saved',
                      'invoices_repeated']}
 
+# field holding the id to put or delete an object with, for the functions
+# that can be synced (see Client.sync)
+SYNCIDFIELDS = {'clients': 'clientnr',
+                'products': 'id'}
+
+# JSON libraries that can be used for decoding responses and encoding bodies,
+# in a fixed order of preference when none is chosen explicitly. This is not a
+# ranking by speed, which depends on the versions installed and the data; run
+# benchmarks/bench_json.py to pick one for an installation
+JSONBACKENDS = ['orjson', 'ujson', 'simplejson', 'json']
+
 
 class FactuursturenError(Exception):
     """Base class for exceptions in this module."""
@@ -137,6 +196,12 @@ class FactuursturenNotFound(FactuursturenError):
 class FactuursturenNoMoreApiCalls(FactuursturenError):
     pass
 
+class _Answer(object):
+    """result of an item of a bulk call that needs no API call (see Client._bulk)"""
+    def __init__(self, result):
+        self.result = result
+
+
 class Client:
     """
     client class to access www.factuursturen.nl though REST API
@@ -149,7 +214,11 @@ class Client:
                  host='www.factuursturen.nl',
                  protocol='https',
                  apipath='/api',
-                 version='v0'):
+                 version='v0',
+                 json_backend=None,
+                 intern_strings=False,
+                 validate=True,
+                 pool_size=10):
         """
         initialize object
 
@@ -160,6 +229,10 @@ class Client:
         :param apikey: APIkey (string) as generated online on the website http://www.factuursturen.nl
         :param username: accountname for the website
         :param configsection: section in file ~/.factuursturen_rc where apikey and username should be present
+        :param json_backend: JSON library to use (one of JSONBACKENDS). Default: the first of JSONBACKENDS that is installed
+        :param intern_strings: let equal values of the fields in INTERNFIELDS share one string object
+        :param validate: check data before posting or putting it, so invalid data does not cost an API call
+        :param pool_size: number of connections to keep open to the API (for concurrent calls)
         """
         self._url = protocol + '://' + host + apipath + '/' + version + '/'
 
@@ -187,13 +260,35 @@ class Client:
             self._apikey = apikey
             self._username = username
 
-        # remaining allowed calls to API
+        # remaining allowed calls to API, and calls that are being made
+        # concurrently (see _reserve_call)
         self._remaining = None
+        self._inflight = 0
+        self._calllock = threading.Lock()
         self._lastresponse = None
+        self._bulkstats = None
+
+        # one session for all calls, so connections are reused
+        self._session = requests.Session()
+        self._session.mount(protocol + '://', requests.adapters.HTTPAdapter(pool_maxsize=pool_size))
 
         self._headers = {'content-type': 'application/json',
                          'accept': 'application/json'}
 
+        self._json_backend, self._json_loads, self._json_dumps = self._load_json_backend(json_backend)
+
+        # table of shared strings, see _intern
+        self._intern_strings = intern_strings
+        self._interned = {}
+
+        # compiled validators per function, see _validator
+        self._validate = validate
+        self._validators = {}
+
+        # flattened keys for posting, see _keypath
+        self._keypaths = {}
+        self._formheaders = {'content-type': 'application/x-www-form-urlencoded'}
+
         # keep a list of which functions can be used to convert the fields
         # from and to a string
         self._convertfunctions = {'fromstring': {'int': self._string2int,
@@ -205,6 +300,22 @@ class Client:
                                                'float': self._float2string,
                                                'date': self._date2string}}
 
+    def _load_json_backend(self, name):
+        """find a JSON library and return its name and its loads and dumps functions
+
+        :param name: name of the library (one of JSONBACKENDS), or None to pick
+                     the first one from JSONBACKENDS that is installed
+        """
+        if name is not None and name not in JSONBACKENDS:
+            raise FactuursturenWrongCall('unknown JSON backend {}'.format(name))
+        for candidate in [name] if name else JSONBACKENDS:
+            try:
+                module = importlib.import_module(candidate)
+            except ImportError:
+                continue
+            return candidate, module.loads, module.dumps
+        raise FactuursturenWrongCall('JSON backend {} is not installed'.format(name))
+
     # single value conversionfunctions
     def _string2int(self, string):
         try:
@@ -230,7 +341,7 @@ class Client:
             raise FactuursturenConversionError('cannot convert {} to date'.format(string))
 
     def _int2string(self, number):
-        if not isinstance(number, int):
+        if not isinstance(number, (int, long)):
             raise FactuursturenConversionError('number {} should be of type int'.format(number))
         return str(number)
 
@@ -240,7 +351,7 @@ class Client:
         return str(booleanvalue).lower()
 
     def _float2string(self, number):
-         if not (isinstance(number, float) or (isinstance(number, int))):
+         if not isinstance(number, (int, long, float)):
             raise FactuursturenConversionError('number {} should be of type float'.format(number))
          return str(number)
 
@@ -273,8 +384,41 @@ class Client:
                     except FactuursturenConversionError:
                         print "key = {}, value = {}, direction = {}, target = {}".format(key, value, direction, target)
                         raise BaseException
+        if self._intern_strings and direction == 'fromstring':
+            for key in INTERNFIELDS.get(function, []):
+                if key in adict:
+                    adict[key] = self._intern(adict[key])
         return adict
 
+    def convert_fields(self, function, adict):
+        """return a copy of a dict with the string values of its typed fields converted
+
+        Fields listed in CONVERTABLEFIELDS get the types get() returns them in;
+        values that are not strings (like numbers read from JSON) are kept as
+        they are. Useful for data read from files, where everything is a string.
+
+        :param function: callable function in the API ('clients', 'products' etc)
+        :param adict: dict to convert
+        """
+        fieldtypes = CONVERTABLEFIELDS.get(function, {})
+        converted = dict(adict)
+        for key, value in adict.iteritems():
+            if key in fieldtypes and isinstance(value, basestring):
+                converted[key] = self._convertfunctions['fromstring'][fieldtypes[key]](value)
+        return converted
+
+    def _intern(self, value):
+        """return the shared copy of a string value
+
+        The builtin intern() does not accept unicode, which is what the JSON
+        decoder returns, so a table per client is used instead.
+
+        :param value: value to share
+        """
+        if not isinstance(value, basestring):
+            return value
+        return self._interned.setdefault(value, value)
+
     def _convertstringfields_in_list_of_dicts(self, alist, function, direction):
         """convert each dict in the list
 
@@ -290,6 +434,70 @@ class Client:
             alist[index] = self._convertstringfields_in_dict(alist[index], function, direction)
         return alist
 
+    def _convert_to_columns(self, alist, function):
+        """convert a list of dicts as returned by the API into a dict of columns
+
+        Fields listed in CONVERTABLEFIELDS are converted straight from the strings
+        in the JSON into typed columns: NumPy arrays when NumPy is installed,
+        array.array otherwise ('l' for int, 'd' for float, 'b' for bool).
+        With NumPy, dates become datetime64[D] arrays (empty dates are NaT);
+        without it they are lists of datetime objects. All other fields are
+        returned as plain lists.
+        A field missing from some records is filled in the same way: NaT or
+        None for dates, False for bools and NaN for numbers, which makes an int
+        column with missing values a float column.
+
+        :param alist: list of dicts as decoded from the JSON response
+        :param function: callable function in the API ('clients', 'products' etc)
+        """
+        fieldtypes = CONVERTABLEFIELDS.get(function, {})
+        fieldnames = []
+        for record in alist:
+            for key in record:
+                if key not in fieldnames:
+                    fieldnames.append(key)
+
+        columns = {}
+        for key in fieldnames:
+            values = [record.get(key) for record in alist]
+            target = fieldtypes.get(key)
+            if self._intern_strings and key in INTERNFIELDS.get(function, []):
+                values = [self._intern(value) for value in values]
+            try:
+                columns[key] = self._make_column(values, target)
+            except (ValueError, TypeError, AttributeError):
+                raise FactuursturenConversionError('cannot convert column {} to {}'.format(key, target))
+        return columns
+
+    def _make_column(self, values, target):
+        """build a single column from a list of raw values
+
+        :param values: list of strings as found in the JSON
+        :param target: type from CONVERTABLEFIELDS ('int', 'float', 'bool', 'date') or None
+        """
+        if target is None:
+            return values
+        if target == 'date':
+            if numpy is not None:
+                return numpy.array([value or 'NaT' for value in values], dtype='datetime64[D]')
+            return [self._string2date(value or '') for value in values]
+        if target == 'bool':
+            values = [value is not None and self._string2bool(value) for value in values]
+            if numpy is not None:
+                return numpy.array(values, dtype=numpy.bool_)
+            return array.array('b', values)
+        if None in values:
+            # there is no NaN for int
+            values = ['nan' if value is None else value for value in values]
+            target = 'float'
+        if numpy is not None:
+            if target == 'int':
+                return numpy.array(values).astype(numpy.int64)
+            return numpy.array(values).astype(numpy.float64)
+        if target == 'int':
+            return array.array('l', [self._string2int(value) for value in values])
+        return array.array('d', [self._string2float(value) for value in values])
+
     def _flatten(self, adict, parent_key=''):
         """flatten a nested dict
 
@@ -340,15 +548,140 @@ class Client:
         return adict
 
     def _prepare_for_send(self, adict, function):
-        """fix dict so it can be posted
+        """return a flat copy of dict that can be posted
+
+        The dict of the caller is not changed.
 
         :param adict: dictionary to be posted
         :param function: callable function from the API ('clients', 'products', etc)
         """
-        adict = self._convertstringfields_in_dict(adict, function, 'tostring')
-        adict = self._flatten(adict)
-        adict = self._fixkeynames(adict)
-        return adict
+        return dict(self._serialize(adict, function))
+
+    def _encode_for_send(self, adict, function):
+        """return dict as an urlencoded form body that can be posted
+
+        values are encoded the way requests encodes a dict passed as data:
+        None values are left out, lists and tuples become repeated keys and
+        unicode is encoded as UTF-8
+
+        :param adict: dictionary to be posted
+        :param function: callable function from the API ('clients', 'products', etc)
+        """
+        body = []
+        for key, value in self._serialize(adict, function):
+            if isinstance(key, unicode):
+                key = key.encode('utf-8')
+            for item in value if isinstance(value, (list, tuple)) else [value]:
+                if item is None:
+                    continue
+                if isinstance(item, unicode):
+                    item = item.encode('utf-8')
+                body.append((key, item))
+        return urllib.urlencode(body)
+
+    def _serialize(self, adict, function):
+        """walk a (nested) dict once and return the flat (key, value) pairs to send
+
+        This does in a single pass what _convertstringfields_in_dict, _flatten
+        and _fixkeynames would do in three: top level fields are converted to
+        strings, nested dicts are flattened and in keys of two levels deep the
+        middle part is reduced to its digits, so
+        {'lines': {'line0': {'amount': 1}}} becomes {'lines[0][amount]': 1}
+
+        :param adict: dictionary to be posted
+        :param function: callable function from the API ('clients', 'products', etc)
+        """
+        fieldtypes = CONVERTABLEFIELDS.get(function, {})
+        tostring = self._convertfunctions['tostring']
+        pairs = []
+        for key, value in adict.iteritems():
+            if isinstance(value, collections.MutableMapping):
+                self._serialize_nested(value, key, pairs)
+            elif key in fieldtypes:
+                pairs.append((key, tostring[fieldtypes[key]](value)))
+            else:
+                pairs.append((key, value))
+        return pairs
+
+    def _serialize_nested(self, adict, parent_key, pairs):
+        """append the flattened items of a nested dict to pairs
+
+        :param adict: nested dict
+        :param parent_key: flattened key of adict
+        :param pairs: list of (key, value) pairs to extend
+        """
+        for key, value in adict.iteritems():
+            nested = isinstance(value, collections.MutableMapping)
+            new_key = self._keypath(parent_key, key, nested)
+            if nested:
+                self._serialize_nested(value, new_key, pairs)
+            else:
+                pairs.append((new_key, value))
+
+    def _keypath(self, parent_key, key, nested):
+        """return (cached) flattened key for key below parent_key
+
+        :param parent_key: flattened key of the parent, like 'lines'
+        :param key: key in the nested dict, like 'line0'
+        :param nested: True when the value of key is a dict itself
+        """
+        cachekey = (parent_key, key, nested)
+        try:
+            return self._keypaths[cachekey]
+        except KeyError:
+            pass
+        if nested and '[' not in parent_key:
+            # second level key of a dict that goes deeper: 'line0' becomes '0'
+            key = ''.join(character for character in key if character in '0123456789')
+        keypath = parent_key + '[' + key + ']'
+        self._keypaths[cachekey] = keypath
+        return keypath
+
+    def _validator(self, function):
+        """return (cached) function that checks a dict before it is sent to function
+
+        The returned function takes a dict and returns a list of problems found
+        (empty when the dict is fine): missing REQUIREDFIELDS, values in
+        CONVERTABLEFIELDS of the wrong type and, for invoices, lines that are
+        not a dict of dicts with the REQUIREDLINEFIELDS and LINEFIELDS types.
+
+        :param function: callable function from the API ('clients', 'products', etc)
+        """
+        try:
+            return self._validators[function]
+        except KeyError:
+            pass
+
+        required = tuple(REQUIREDFIELDS.get(function, []))
+        typed = tuple((key, VALIDATIONTYPES[target], target)
+                      for key, target in CONVERTABLEFIELDS.get(function, {}).iteritems())
+        linetyped = tuple((key, VALIDATIONTYPES[target], target) for key, target in LINEFIELDS.iteritems())
+        check_lines = function == 'invoices'
+
+        def validate(adict):
+            problems = ['missing field {}'.format(key) for key in required if key not in adict]
+            for key, types, target in typed:
+                if key in adict and not isinstance(adict[key], types):
+                    problems.append('field {} should be of type {}'.format(key, target))
+            if check_lines and 'lines' in adict:
+                lines = adict['lines']
+                if not isinstance(lines, collections.MutableMapping) or not lines:
+                    problems.append('field lines should be a non-empty dict of lines')
+                    return problems
+                for linekey, line in lines.iteritems():
+                    if not isinstance(line, collections.MutableMapping):
+                        problems.append('line {} should be a dict'.format(linekey))
+                        continue
+                    for key in REQUIREDLINEFIELDS:
+                        if key not in line:
+                            problems.append('missing field {} in line {}'.format(key, linekey))
+                    for key, types, target in linetyped:
+                        if key in line and not isinstance(line[key], types):
+                            problems.append('field {} in line {} should be of type {}'.format(key, linekey, target))
+            return problems
+
+        self._validators[function] = validate
+        return validate
 
     def _escape_characters(self, string):
         """escape unsafe webcharacters to use in API call
@@ -368,6 +701,21 @@ class Client:
         """return status of last call"""
         return self._lastresponse
 
+    @property
+    def bulkstats(self):
+        """return statistics of the last bulk call (post_many, put_many, delete_many, send_many or run_many)
+
+        a dict with the number of calls attempted, the number of errors, the
+        number of items skipped because the journal had them as done, the
+        seconds it took and the resulting calls per second
+        """
+        return self._bulkstats
+
+    @property
+    def json_backend(self):
+        """return name of the JSON library in use"""
+        return self._json_backend
+
     def post(self, function, objData):
         """Generic wrapper for all POSTable functions
 
@@ -376,17 +724,69 @@ class Client:
         :param function: callabe function from the API ('clients', 'products', etc)
         :param objData: data to be posted
         """
-        fullUrl = self._url + function
-        objData_local = copy.deepcopy(objData)
         if function not in API['posters']:
             raise FactuursturenPostError("{function} not in available POSTable functions".format(function=function))
 
-        if isinstance(objData_local, dict):
-            objData_local = self._prepare_for_send(objData_local, function)
+        body, headers = self._prepare_body(objData, function, FactuursturenWrongPostvalue)
+        return self._send_post(function, body, headers)
+
+    def post_many(self, function, items, concurrency=4, journal=None):
+        """post a list of objects concurrently
+
+        Items are validated and encoded just ahead of being sent by concurrency
+        threads that share the connections and the remaining API calls of this
+        client (see run_many); when no calls are left, the items that have not
+        been sent yet get a FactuursturenNoMoreApiCalls error.
+
+        With a journal, a rerun after an interruption or failure skips the items
+        that were completed. Once every item succeeded, the entries of the call
+        are removed from the journal, so a later call sends all its items.
+
+        returns a list in the same order as items, holding for each item either
+        the result of the post (the id of the new object) or the FactuursturenError
+        that occurred for that item
+
+        :param function: callabe function from the API ('clients', 'products', etc)
+        :param items: list of dicts to be posted
+        :param concurrency: number of calls to make at the same time
+        :param journal: Journal to record the calls in; items completed in an earlier run are not sent again
+        """
+        if function not in API['posters']:
+            raise FactuursturenPostError("{function} not in available POSTable functions".format(function=function))
+
+        return self._collect(len(items), self._bulk(function, [('post', None, item) for item in items],
+                                                    concurrency, journal))
+
+    def _prepare_body(self, objData, function, exceptionclass):
+        """validate and encode data to be posted or put
 
-        response = requests.post(fullUrl,
-                                 data=objData_local,
-                                 auth=(self._username, self._apikey))
+        returns the body and the headers to send it with. Data that is not a dict is
+        sent as it is.
+
+        :param objData: data to be sent
+        :param function: callabe function from the API ('clients', 'products', etc)
+        :param exceptionclass: exception to raise when the data is not valid
+        """
+        if not isinstance(objData, dict):
+            return objData, None
+        if self._validate:
+            problems = self._validator(function)(objData)
+            if problems:
+                raise exceptionclass('; '.join(problems))
+        return self._encode_for_send(objData, function), self._formheaders
+
+    def _send_post(self, function, body, headers):
+        """post a prepared body
+
+        :param function: callabe function from the API ('clients', 'products', etc)
+        :param body: body as returned by _prepare_body
+        :param headers: headers as returned by _prepare_body
+        """
+        fullUrl = self._url + function
+        response = self._session.post(fullUrl,
+                                      data=body,
+                                      headers=headers,
+                                      auth=(self._username, self._apikey))
         self._lastresponse = response.ok
 
         if response.ok:
@@ -395,6 +795,247 @@ class Client:
         else:
             raise FactuursturenWrongPostvalue(response.content)
 
+    def send_many(self, function, items, concurrency=4, journal=None, readahead=None):
+        """post new objects and put existing ones, reading the items as they are needed
+
+        Unlike post_many and put_many, items can be any iterable (like the rows of a
+        file being read): only a few items more than concurrency are read ahead, so
+        memory use does not depend on the number of items. Items with an objId of
+        None are posted, the others are put.
+
+        yields (position, result) tuples in the order the calls finish, where
+        position is the position of the item in items and result the id of the
+        new object (posts), None (puts) or the FactuursturenError that occurred.
+        When a journal is given, its entries are removed once every item succeeded.
+
+        :param function: 'clients' or 'products'
+        :param items: iterable of (objId, objData) tuples
+        :param concurrency: number of calls to make at the same time
+        :param journal: Journal to record the calls in; items completed in an earlier run are not sent again
+        :param readahead: number of items read ahead of the threads (default: 4 per thread)
+        """
+        if function not in API['posters'] or function not in API['putters']:
+            raise FactuursturenPostError("{function} cannot be both posted and put".format(function=function))
+        verbs = (('post' if objId is None else 'put', objId, objData) for objId, objData in items)
+        return self._bulk(function, verbs, concurrency, journal, readahead)
+
+    def _bulk(self, function, items, concurrency, journal, readahead=None):
+        """prepare, journal and send the calls of a bulk operation
+
+        yields (position, result) tuples, see send_many. Items that fail validation
+        or were completed in an earlier run are answered without a call.
+
+        :param function: callable function from the API ('clients', 'products', etc)
+        :param items: iterable of (verb, objId, objData) tuples; verb is 'post', 'put' or 'delete'
+        :param concurrency: number of calls to make at the same time
+        :param journal: Journal or None
+        :param readahead: see run_many
+        """
+        skipped = [0]
+        run = Journal.new_run()
+
+        def jobs():
+            occurrences = collections.Counter()
+            for position, (verb, objId, objData) in enumerate(items):
+                try:
+                    if verb == 'post':
+                        body, headers = self._prepare_body(objData, function, FactuursturenWrongPostvalue)
+                        job = functools.partial(self._send_post, function, body, headers)
+                    elif verb == 'put':
+                        body, headers = self._prepare_body(objData, function, FactuursturenWrongPutvalue)
+                        job = functools.partial(self._send_put, function, objId, body, headers)
+                    else:
+                        body = None
+                        job = functools.partial(self._send_delete, function, objId)
+                except FactuursturenError as error:
+                    # answered through the same queue as the calls, so a long run of
+                    # these is not read ahead without bound
+                    yield position, _Answer(error)
+                    continue
+                if journal is not None:
+                    # identical items are told apart by how often they occurred before,
+                    # so adding or removing other items does not change their keys
+                    digest = Journal.key(verb, function, objId, body, 0)
+                    key = Journal.key(verb, function, objId, body, occurrences[digest])
+                    occurrences[digest] += 1
+                    entry = journal.lookup(key)
+                    if entry is not None and entry[0] == 'done':
+                        skipped[0] += 1
+                        journal.claim(key, run)
+                        yield position, _Answer(entry[1])
+                        continue
+                    if entry is not None and entry[0] == 'pending' and verb == 'post':
+                        yield position, _Answer(FactuursturenPostError(
+                            'post was interrupted in an earlier run, the object may exist already '
+                            '(journal key {})'.format(key)))
+                        continue
+                    job = functools.partial(self._journaled, journal, key, run, verb, function, objId, job)
+                yield position, job
+
+        failed = False
+        try:
+            for outcome in self.run_many(jobs(), concurrency, readahead):
+                failed = failed or isinstance(outcome[1], FactuursturenError)
+                yield outcome
+        finally:
+            self._bulkstats['skipped'] = skipped[0]
+        if journal is not None and not failed:
+            # the journal is only needed to restart this call; a later call that
+            # sends the same content again (like a value set back) has to be sent
+            journal.forget_run(run)
+
+    def _collect(self, count, outcomes):
+        """return the results of a bulk operation as a list in the order of its items
+
+        :param count: number of items
+        :param outcomes: (position, result) tuples
+        """
+        # an item without an outcome can not be taken for a success
+        results = [FactuursturenError('not sent')] * count
+        for position, result in outcomes:
+            results[position] = result
+        return results
+
+    def _journaled(self, journal, key, run, verb, function, objId, job):
+        """run a job of a bulk call, recording intent and outcome in the journal
+
+        :param journal: Journal
+        :param key: key of the item in the journal
+        :param run: id of the bulk call in the journal
+        :param verb: 'post', 'put' or 'delete'
+        :param function: callabe function from the API ('clients', 'products', etc)
+        :param objId: id of the object (None for posts)
+        :param job: callable making the call
+        """
+        journal.begin(key, verb, function, objId, run)
+        try:
+            result = job()
+        except FactuursturenError as error:
+            journal.finish(key, 'failed', str(error))
+            raise
+        journal.finish(key, 'done', result)
+        return result
+
+    def run_many(self, jobs, concurrency=4, readahead=None):
+        """run callables in concurrency threads that share the connections and remaining API calls
+
+        Each job is only started when an API call is left for it (see
+        _reserve_call); when none are left, it gets a FactuursturenNoMoreApiCalls
+        error. Exceptions are returned instead of raised, so one failing job does
+        not stop the others; exceptions that are not a FactuursturenError are
+        returned as one. Jobs are taken from jobs as they are needed, so it can
+        be a generator. Stopping the iteration early stops starting new jobs.
+
+        yields (key, result) tuples in the order the jobs finish, where result is
+        the value returned by the job or the FactuursturenError it raised. When
+        all jobs are done, bulkstats describes the run.
+
+        :param jobs: iterable of (key, callable) tuples
+        :param concurrency: number of threads
+        :param readahead: number of jobs taken from jobs ahead of the threads (default: 4 per thread)
+        """
+        start = time.time()
+        todo = Queue.Queue(maxsize=readahead or 4 * concurrency)
+        done = Queue.Queue(maxsize=readahead or 4 * concurrency)
+        stop = threading.Event()
+        feederror = []
+        if isinstance(jobs, list):
+            concurrency = min(concurrency, len(jobs))
+        concurrency = max(concurrency, 1)
+
+        def put(queue, item):
+            """put item in a bounded queue, unless the run is stopped first"""
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return
+                except Queue.Full:
+                    pass
+
+        def feeder():
+            try:
+                for job in jobs:
+                    put(todo, job)
+                    if stop.is_set():
+                        break
+            except Exception as error:
+                feederror.append(error)
+            finally:
+                for _ in range(concurrency):
+                    todo.put(None)
+
+        def worker():
+            while True:
+                item = todo.get()
+                if item is None:
+                    put(done, None)
+                    return
+                key, job = item
+                if stop.is_set():
+                    continue
+                if isinstance(job, _Answer):
+                    # found by _bulk without a call
+                    put(done, (key, job.result, False))
+                    continue
+                if not self._reserve_call():
+                    put(done, (key, FactuursturenNoMoreApiCalls('limit of API calls reached.'), True))
+                    continue
+                try:
+                    result = job()
+                except FactuursturenError as error:
+                    result = error
+                except requests.RequestException as error:
+                    result = FactuursturenError(str(error))
+                except Exception as error:
+                    # anything else would end this thread and leave its jobs unsent
+                    result = FactuursturenError('{}: {}'.format(type(error).__name__, error))
+                finally:
+                    self._release_call()
+                put(done, (key, result, True))
+
+        threads = [threading.Thread(target=feeder)] + [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        self._bulkstats = {'calls': 0, 'errors': 0, 'skipped': 0}
+        try:
+            finished = 0
+            while finished < concurrency:
+                outcome = done.get()
+                if outcome is None:
+                    finished += 1
+                    continue
+                key, result, called = outcome
+                if called:
+                    self._bulkstats['calls'] += 1
+                    self._bulkstats['errors'] += isinstance(result, FactuursturenError)
+                yield key, result
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            elapsed = time.time() - start
+            self._bulkstats['seconds'] = elapsed
+            self._bulkstats['calls_per_second'] = self._bulkstats['calls'] / elapsed if elapsed else 0.0
+        if feederror:
+            raise feederror[0]
+
+    def _reserve_call(self):
+        """claim one of the remaining API calls for a call that is about to be made
+
+        returns False when all remaining calls are claimed by calls in progress already
+        """
+        with self._calllock:
+            if self._remaining is not None and self._remaining - self._inflight <= 0:
+                return False
+            self._inflight += 1
+            return True
+
+    def _release_call(self):
+        """release a call claimed with _reserve_call once it is finished"""
+        with self._calllock:
+            self._inflight -= 1
+
     def put(self, function, objId, objData):
         """Generic wrapper for all PUTable functions
 
@@ -404,17 +1045,45 @@ class Client:
         :param objId: id of object to be put (usually retrieved from the API)
         :param objData: data to be posted. All required fields should be present, or the API will not accept the changes
         """
-        fullUrl = self._url + function + '/{objId}'.format(objId=self._escape_characters(objId))
+        if function not in API['putters']:
+            raise FactuursturenPostError("{function} not in available PUTable functions".format(function=function))
 
+        body, headers = self._prepare_body(objData, function, FactuursturenWrongPutvalue)
+        return self._send_put(function, objId, body, headers)
+
+    def put_many(self, function, items, concurrency=4, journal=None):
+        """put a list of objects concurrently
+
+        Works like post_many: items are validated and encoded, and sent by concurrency
+        threads sharing the connections and remaining API calls.
+
+        returns a list in the same order as items, holding None for each item that
+        was put and the FactuursturenError that occurred for the others
+
+        :param function: callabe function from the API ('clients', 'products', etc)
+        :param items: list of (objId, objData) tuples
+        :param concurrency: number of calls to make at the same time
+        :param journal: Journal to record the calls in; items completed in an earlier run are not sent again
+        """
         if function not in API['putters']:
             raise FactuursturenPostError("{function} not in available PUTable functions".format(function=function))
 
-        if isinstance(objData, dict):
-            objData = self._prepare_for_send(objData, function)
+        return self._collect(len(items), self._bulk(function, [('put', objId, objData) for objId, objData in items],
+                                                    concurrency, journal))
+
+    def _send_put(self, function, objId, body, headers):
+        """put a prepared body
 
-        response = requests.put(fullUrl,
-                                 data=objData,
-                                 auth=(self._username, self._apikey))
+        :param function: callabe function from the API ('clients', 'products', etc)
+        :param objId: id of object to be put
+        :param body: body as returned by _prepare_body
+        :param headers: headers as returned by _prepare_body
+        """
+        fullUrl = self._url + function + '/{objId}'.format(objId=self._escape_characters(objId))
+        response = self._session.put(fullUrl,
+                                     data=body,
+                                     headers=headers,
+                                     auth=(self._username, self._apikey))
         self._lastresponse = response.ok
 
         if response.ok:
@@ -430,13 +1099,37 @@ class Client:
         :param function: callabe function from the API ('clients', 'products', etc)
         :param objId: id of object to be put (usually retrieved from the API)
         """
-        fullUrl = self._url + function + '/{objId}'.format(objId=self._escape_characters(objId))
+        if function not in API['deleters']:
+            raise FactuursturenPostError("{function} not in available DELETEable functions".format(function=function))
+
+        self._send_delete(function, objId)
+
+    def delete_many(self, function, objIds, concurrency=4, journal=None):
+        """delete a list of objects concurrently
 
+        returns a list in the same order as objIds, holding None for each object
+        that was deleted and the FactuursturenError that occurred for the others
+
+        :param function: callabe function from the API ('clients', 'products', etc)
+        :param objIds: list of ids of objects to be deleted
+        :param concurrency: number of calls to make at the same time
+        :param journal: Journal to record the calls in; objects deleted in an earlier run are not deleted again
+        """
         if function not in API['deleters']:
             raise FactuursturenPostError("{function} not in available DELETEable functions".format(function=function))
 
-        response = requests.delete(fullUrl,
-                                 auth=(self._username, self._apikey))
+        return self._collect(len(objIds), self._bulk(function, [('delete', objId, None) for objId in objIds],
+                                                      concurrency, journal))
+
+    def _send_delete(self, function, objId):
+        """delete a single object
+
+        :param function: callabe function from the API ('clients', 'products', etc)
+        :param objId: id of object to be deleted
+        """
+        fullUrl = self._url + function + '/{objId}'.format(objId=self._escape_characters(objId))
+        response = self._session.delete(fullUrl,
+                                        auth=(self._username, self._apikey))
         self._lastresponse = response.ok
 
         if response.ok:
@@ -445,14 +1138,157 @@ class Client:
             raise FactuursturenError(response.content)
 
 
-    def get(self, function, objId=None):
+    def sync(self, function, desired, keyfield, delete=False, cachefile=None, refresh=False,
+             concurrency=4, journal=None):
+        """make the objects in the API match a desired list, using as few calls as possible
+
+        Each desired record is matched on keyfield (for instance 'code' for products)
+        with the known objects and compared by a hash of its fields: new records are
+        posted, changed records are put and unchanged records are skipped. With
+        delete, known objects that are not desired anymore are deleted.
+
+        The known objects are read with a single get, or, when cachefile exists (and
+        refresh is False), from the hashes stored there by the previous sync, in
+        which case no get is needed at all. Use refresh when objects may have been
+        changed outside of sync.
+
+        returns a dict with the number of records created, updated, deleted,
+        unchanged and failed, the number of API calls made, the number of calls
+        saved compared to putting every desired record, and a list of
+        (key, FactuursturenError) tuples for the failures
+
+        :param function: 'clients' or 'products'
+        :param desired: list of dicts, each holding all fields of the object and keyfield
+        :param keyfield: field identifying a record
+        :param delete: delete known objects that are not in desired
+        :param cachefile: file to keep the hashes of the known objects in
+        :param refresh: get the known objects from the API even when cachefile exists
+        :param concurrency: number of calls to make at the same time
+        :param journal: Journal to record the calls in (see post_many)
+        """
+        if function not in SYNCIDFIELDS:
+            raise FactuursturenWrongCall('sync is only available for {}'.format(', '.join(SYNCIDFIELDS)))
+        idfield = SYNCIDFIELDS[function]
+
+        # known maps a key to (objId, hash), or to (objId, None, record) when
+        # the hash can only be made once the fields of the desired record are known
+        known = None
+        calls = 0
+        if cachefile and not refresh and os.path.exists(cachefile):
+            with open(cachefile, 'rb') as f:
+                cache = self._json_loads(f.read())
+            if cache.get('function') == function and cache.get('keyfield') == keyfield:
+                known = dict((key, tuple(value)) for key, value in cache['records'].iteritems())
+        if known is None:
+            known = {}
+            for record in self.iter_get(function):
+                if record.get(keyfield) not in (None, ''):
+                    known[unicode(record[keyfield])] = (record.get(idfield), None, record)
+            calls += 1
+
+        hashes = {}
+        creates = []
+        updates = []
+        unchanged = 0
+        for record in desired:
+            key = unicode(record[keyfield])
+            fields = sorted(record)
+            hashes[key] = self._record_hash(record, function, fields)
+            if key not in known:
+                creates.append((key, record))
+                continue
+            objId, oldhash = known[key][:2]
+            if oldhash is None and len(known[key]) == 3:
+                oldhash = self._record_hash(known[key][2], function, fields)
+            known[key] = (objId, oldhash)
+            if oldhash is not None and oldhash == hashes[key]:
+                unchanged += 1
+            else:
+                updates.append((key, objId, record))
+        deletes = [(key, entry[0]) for key, entry in known.iteritems() if key not in hashes] if delete else []
+
+        # what will be stored in cachefile: (objId, hash) per key. Objects that are
+        # not desired keep a hash of None, so they are put when they are desired again
+        records = dict((key, entry[:2]) for key, entry in known.iteritems())
+        report = {'created': 0,
+                  'updated': 0,
+                  'deleted': 0,
+                  'unchanged': unchanged,
+                  'errors': []}
+        results = self.post_many(function, [record for key, record in creates], concurrency, journal)
+        for (key, record), result in zip(creates, results):
+            if isinstance(result, FactuursturenError):
+                report['errors'].append((key, result))
+            else:
+                records[key] = (result, hashes[key])
+                report['created'] += 1
+        results = self.put_many(function, [(objId, record) for key, objId, record in updates], concurrency, journal)
+        for (key, objId, record), result in zip(updates, results):
+            if isinstance(result, FactuursturenError):
+                report['errors'].append((key, result))
+            else:
+                records[key] = (objId, hashes[key])
+                report['updated'] += 1
+        results = self.delete_many(function, [objId for key, objId in deletes], concurrency, journal)
+        for (key, objId), result in zip(deletes, results):
+            if isinstance(result, FactuursturenError):
+                report['errors'].append((key, result))
+            else:
+                del records[key]
+                report['deleted'] += 1
+
+        if cachefile:
+            temporary = cachefile + '.tmp'
+            with open(temporary, 'wb') as f:
+                f.write(self._json_dumps({'function': function,
+                                          'keyfield': keyfield,
+                                          'records': records}))
+            os.rename(temporary, cachefile)
+
+        report['failed'] = len(report['errors'])
+        report['calls'] = calls + len(creates) + len(updates) + len(deletes)
+        # pushing everything would have cost one call per desired record
+        report['calls_saved'] = len(hashes) - (calls + len(creates) + len(updates))
+        return report
+
+    def _record_hash(self, record, function, fields):
+        """return a hash of the given fields of a record, as they would be sent
+
+        returns None when a field cannot be sent (like a missing date), so the
+        record never matches and is put
+
+        :param record: dict
+        :param function: callable function from the API ('clients', 'products', etc)
+        :param fields: names of the fields to include
+        """
+        try:
+            pairs = self._serialize(dict((field, record.get(field)) for field in fields), function)
+        except FactuursturenConversionError:
+            return None
+        # encoded the way _encode_for_send does, so byte strings need not be ASCII
+        encoded = []
+        for key, value in pairs:
+            if isinstance(key, unicode):
+                key = key.encode('utf-8')
+            items = value if isinstance(value, (list, tuple)) else [value]
+            encoded.append((key, [item.encode('utf-8') if isinstance(item, unicode) else str(item)
+                                  for item in items]))
+        return hashlib.sha1(repr(sorted(encoded))).hexdigest()
+
+    def get(self, function, objId=None, as_columns=False, indexed=False):
         """Generic wrapper for all GETtable functions
 
         when no objId is passed, retrieve all objects (in a list of dicts)
         when objId is passed, only retrieve a single object (in a single dict)
+        when as_columns is True, retrieve all objects as a dict of columns (one
+        typed array per field, see _convert_to_columns)
+        when indexed is True, retrieve all objects in an IndexedList, which can
+        find objects by field value or range without scanning the list
 
         :param function: callabe function from the API ('clients', 'products', etc)
         :param objId: id of object to be put (usually retrieved from the API)
+        :param as_columns: return a dict of columns instead of a list of dicts
+        :param indexed: return an IndexedList instead of a list of dicts
         """
 
         # TODO: some errorchecking:
@@ -466,13 +1302,17 @@ class Client:
         # check function against self.getters and self.singleGetters
         if function not in API['getters'] + API['single_getters']:
             raise FactuursturenGetError("{function} not in available GETtable functions".format(function=function))
+        if as_columns and (objId or function not in API['getters']):
+            raise FactuursturenGetError("as_columns can only be used when retrieving all {function}".format(function=function))
+        if indexed and (as_columns or objId or function not in API['getters']):
+            raise FactuursturenGetError("indexed can only be used when retrieving all {function} as a list".format(function=function))
 
         if objId:
             fullUrl += '/{objId}'.format(objId=self._escape_characters(objId))
 
-        response = requests.get(fullUrl,
-                                auth=(self._username, self._apikey),
-                                headers=self._headers)
+        response = self._session.get(fullUrl,
+                                     auth=(self._username, self._apikey),
+                                     headers=self._headers)
         self._lastresponse = response.ok
 
         # when one record is returned, acces it normally so
@@ -486,9 +1326,13 @@ class Client:
             if function == 'invoices_pdf':
                 return response.content
             try:
-                raw_structure = response.json()
-                if objId is None:
+                raw_structure = self._json_loads(response.content)
+                if as_columns:
+                    retval = self._convert_to_columns(raw_structure, function)
+                elif objId is None:
                     retval = self._convertstringfields_in_list_of_dicts(raw_structure, function, 'fromstring')
+                    if indexed:
+                        retval = IndexedList(retval, function)
                 else:
                     retval = self._convertstringfields_in_dict(raw_structure[singlefunction], function, 'fromstring')
             except FactuursturenError as error:
@@ -496,10 +1340,96 @@ class Client:
                 retval = response.content
             return retval
         else:
-            # TODO: more checking
-            if response.status_code == 404:
-                raise FactuursturenNotFound (response.content)
-            elif self._remaining == 0:
-                raise FactuursturenNoMoreApiCalls ('limit of API calls reached.')
+            self._raise_get_error(response)
+
+    def iter_get(self, function, chunk_size=65536):
+        """Generator version of get for retrieving all objects
+
+        The response is streamed and the top-level JSON list is parsed incrementally,
+        so records are yielded (converted, one dict at a time) as soon as they arrive
+        and memory use does not grow with the size of the account.
+
+        :param function: callabe function from the API ('clients', 'products', etc)
+        :param chunk_size: number of bytes to read from the network at a time
+        """
+        fullUrl = self._url + function
+        if function not in API['getters']:
+            raise FactuursturenGetError("{function} not in available GETtable functions".format(function=function))
+
+        response = self._session.get(fullUrl,
+                                     auth=(self._username, self._apikey),
+                                     headers=self._headers,
+                                     stream=True)
+        self._lastresponse = response.ok
+        self._remaining = int(response.headers['x-ratelimit-remaining'])
+
+        try:
+            if not response.ok:
+                self._raise_get_error(response)
+            for record in self._iter_json_list(response.iter_content(chunk_size)):
+                yield self._convertstringfields_in_dict(record, function, 'fromstring')
+        finally:
+            response.close()
+
+    def _iter_json_list(self, chunks):
+        """incrementally parse a JSON list, yielding its elements one by one
+
+        Only the part of the document that has not been parsed yet is kept in memory.
+
+        :param chunks: iterable of strings that together form a JSON document containing a list
+        """
+        decoder = json.JSONDecoder()
+        whitespace = ' \t\n\r'
+        buf = ''
+        pos = 0
+        started = False
+        finished = False
+        chunks = iter(chunks)
+        while not finished:
+            chunk = next(chunks, None)
+            if chunk is None:
+                finished = True
             else:
-                raise FactuursturenEmptyResult (response.content)
+                buf = buf[pos:] + chunk
+                pos = 0
+            while True:
+                while pos < len(buf) and buf[pos] in whitespace:
+                    pos += 1
+                if pos == len(buf):
+                    break
+                if not started:
+                    if buf[pos] != '[':
+                        raise FactuursturenGetError('expected a JSON list in the response')
+                    started = True
+                    pos += 1
+                    continue
+                if buf[pos] == ']':
+                    return
+                if buf[pos] == ',':
+                    pos += 1
+                    continue
+                try:
+                    record, end = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    if finished:
+                        raise FactuursturenGetError('incomplete JSON list in the response')
+                    break
+                if end == len(buf) and not finished:
+                    # a value at the very end of the buffer may continue in the next chunk
+                    break
+                pos = end
+                yield record
+        raise FactuursturenGetError('incomplete JSON list in the response')
+
+    def _raise_get_error(self, response):
+        """raise the exception matching a failed GET
+
+        :param response: response object of the failed request
+        """
+        # TODO: more checking
+        if response.status_code == 404:
+            raise FactuursturenNotFound (response.content)
+        elif self._remaining == 0:
+            raise FactuursturenNoMoreApiCalls ('limit of API calls reached.')
+        else:
+            raise FactuursturenEmptyResult (response.content)
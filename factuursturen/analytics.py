@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+receivables reporting over invoices retrieved as columns
+
+The functions take the columns of get('invoices', as_columns=True). With
+NumPy installed the columns are arrays and every aggregate is computed with
+array operations, without a Python loop over the invoices. Without NumPy the
+same results are computed with plain loops.
+
+"""
+from datetime import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = 'Reinoud van Leeuwen'
+__copyright__ = "Copyright 2013, Reinoud van Leeuwen"
+__license__ = "BSD"
+__maintainer__ = "Reinoud van Leeuwen"
+__email__ = "reinoud.v@n.leeuwen.net"
+
+# upper bounds (in days overdue) of the aging buckets; invoices that are
+# more overdue than the last bound go in a bucket of their own
+AGINGBOUNDS = (0, 30, 60, 90)
+
+
+def receivables(fact, today=None, bounds=AGINGBOUNDS):
+    """get all invoices and return the open amount per client, the aging and the days to pay
+
+    Uses a single API call. returns a dict with the results of
+    open_per_client, aging and days_to_pay.
+
+    :param fact: factuursturen.Client
+    :param today: date to compute the aging on (default: now)
+    :param bounds: upper bounds of the aging buckets in days overdue
+    """
+    columns = fact.get('invoices', as_columns=True)
+    return {'open_per_client': open_per_client(columns),
+            'aging': aging(columns, today, bounds),
+            'days_to_pay': days_to_pay(columns)}
+
+
+def open_per_client(columns):
+    """return a dict with the total open amount per clientnr, for clients that have one
+
+    :param columns: invoices as returned by get('invoices', as_columns=True)
+    """
+    if _vectorized(columns, 'open'):
+        # invoices without an open amount have NaN
+        amounts = numpy.nan_to_num(columns['open'])
+        mask = amounts != 0
+        clients, inverse = numpy.unique(numpy.asarray(columns['clientnr'])[mask], return_inverse=True)
+        totals = numpy.bincount(inverse, weights=amounts[mask], minlength=len(clients))
+        return dict(zip(clients.tolist(), totals.tolist()))
+    totals = {}
+    for clientnr, amount in zip(columns['clientnr'], columns['open']):
+        if amount and amount == amount:
+            totals[clientnr] = totals.get(clientnr, 0.0) + amount
+    return totals
+
+
+def aging(columns, today=None, bounds=AGINGBOUNDS):
+    """return the total open amount per aging bucket, by the number of days past duedate
+
+    The buckets are named after the days overdue they hold: with the default
+    bounds 'current' (not due yet), '1-30', '31-60', '61-90' and '90+'.
+    Invoices without a duedate count as current.
+
+    :param columns: invoices as returned by get('invoices', as_columns=True)
+    :param today: date to compute the days overdue on (default: now)
+    :param bounds: upper bounds of the buckets in days overdue, in increasing order
+    """
+    today = today or datetime.now()
+    labels = _bucket_labels(bounds)
+    if _vectorized(columns, 'open', 'duedate'):
+        amounts = numpy.nan_to_num(columns['open'])
+        duedates = columns['duedate']
+        overdue = (numpy.datetime64(today.strftime('%Y-%m-%d'), 'D') - duedates).astype(numpy.int64)
+        overdue[numpy.isnat(duedates)] = bounds[0]
+        buckets = numpy.searchsorted(numpy.asarray(bounds), overdue, side='left')
+        totals = numpy.bincount(buckets, weights=amounts, minlength=len(labels)).tolist()
+    else:
+        totals = [0.0] * len(labels)
+        for duedate, amount in zip(columns['duedate'], columns['open']):
+            overdue = (today - duedate).days if duedate is not None else bounds[0]
+            bucket = len(bounds)
+            for position, bound in enumerate(bounds):
+                if overdue <= bound:
+                    bucket = position
+                    break
+            if amount == amount:
+                totals[bucket] += amount
+    return dict(zip(labels, totals))
+
+
+def days_to_pay(columns):
+    """return how many days paid invoices took to be paid, from sent to paiddate
+
+    returns a dict with the number of paid invoices ('count'), the 'mean' and
+    'median' days to pay (None when nothing was paid) and the mean days to pay
+    per clientnr ('per_client')
+
+    :param columns: invoices as returned by get('invoices', as_columns=True)
+    """
+    if _vectorized(columns, 'sent', 'paiddate'):
+        mask = ~(numpy.isnat(columns['sent']) | numpy.isnat(columns['paiddate']))
+        days = (columns['paiddate'][mask] - columns['sent'][mask]).astype(numpy.int64)
+        clients, inverse = numpy.unique(numpy.asarray(columns['clientnr'])[mask], return_inverse=True)
+        sums = numpy.bincount(inverse, weights=days, minlength=len(clients))
+        counts = numpy.bincount(inverse, minlength=len(clients))
+        per_client = dict(zip(clients.tolist(), (sums / counts).tolist()))
+        days = days.tolist()
+    else:
+        days = []
+        grouped = {}
+        for clientnr, sent, paiddate in zip(columns['clientnr'], columns['sent'], columns['paiddate']):
+            if sent is not None and paiddate is not None:
+                days.append((paiddate - sent).days)
+                grouped.setdefault(clientnr, []).append(days[-1])
+        per_client = dict((clientnr, float(sum(values)) / len(values)) for clientnr, values in grouped.iteritems())
+    report = {'count': len(days), 'mean': None, 'median': None, 'per_client': per_client}
+    if days:
+        days.sort()
+        middle = len(days) // 2
+        report['mean'] = float(sum(days)) / len(days)
+        report['median'] = float(days[middle]) if len(days) % 2 else (days[middle - 1] + days[middle]) / 2.0
+    return report
+
+
+def _vectorized(columns, *fields):
+    """return True when the given columns are NumPy arrays"""
+    return numpy is not None and all(isinstance(columns[field], numpy.ndarray) for field in fields)
+
+
+def _bucket_labels(bounds):
+    """return the names of the aging buckets for the given bounds"""
+    labels = ['current']
+    for low, high in zip(bounds, bounds[1:]):
+        labels.append('{}-{}'.format(low + 1, high))
+    labels.append('{}+'.format(bounds[-1]))
+    return labels
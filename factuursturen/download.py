@@ -0,0 +1,557 @@
+#!/usr/bin/env python
+"""
+building blocks of bin/downloadinvoices.py
+
+A manifest of the invoices downloaded before, writers that save the PDFs as
+separate files or into archives per year, and the functions that divide the
+invoices over shards and the API calls over hours.
+
+"""
+import errno
+import functools
+import hashlib
+import os
+import shutil
+import sqlite3
+import StringIO
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+import factuursturen
+
+__author__ = 'Reinoud van Leeuwen'
+__copyright__ = "Copyright 2013, Reinoud van Leeuwen"
+__license__ = "BSD"
+__maintainer__ = "Reinoud van Leeuwen"
+__email__ = "reinoud.v@n.leeuwen.net"
+
+
+def mkdir_p(dirname):
+    try:
+        os.makedirs(dirname)
+    except OSError as exc: # Python >2.5
+        if exc.errno == errno.EEXIST and os.path.isdir(dirname):
+            pass
+        else: raise
+
+
+class Manifest:
+    """
+    record of downloaded invoices, kept in an SQLite database
+
+    For each invoice the file, its size and checksum are stored, together with
+    the fields that change during the life of an invoice, so a later run only
+    needs to download invoices that are new or changed.
+    """
+    # fields of an invoice that change when something happens to it
+    STATEFIELDS = ['sent', 'paiddate', 'lastreminder']
+
+    def __init__(self, filename, readonly=False):
+        """
+        :param filename: name of the database
+        :param readonly: only read an existing manifest, and do not create one (for a dry run)
+        """
+        # the manifest is written from the download threads, and can be shared
+        # by several processes downloading different shards
+        self._lock = threading.Lock()
+        if readonly and os.path.exists(filename):
+            self._connection = sqlite3.connect(filename, timeout=60, check_same_thread=False)
+            return
+        if readonly:
+            # nothing was downloaded before
+            filename = ':memory:'
+        self._connection = sqlite3.connect(filename, timeout=60, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS invoices ('
+                                 ' invoicenr TEXT PRIMARY KEY,'
+                                 ' filename TEXT,'
+                                 ' size INTEGER,'
+                                 ' checksum TEXT,'
+                                 ' state TEXT,'
+                                 ' downloaded REAL)')
+        self._connection.commit()
+
+    def state(self, invoice):
+        """return the state fields of an invoice as a single string
+
+        :param invoice: invoice dict as returned by the API
+        """
+        return '|'.join(str(invoice.get(field) or '') for field in self.STATEFIELDS)
+
+    def is_current(self, invoice, filename, writer):
+        """return True when filename holds the invoice as it is now
+
+        :param invoice: invoice dict as returned by the API
+        :param filename: file the invoice is saved in
+        :param writer: BatchedWriter or ArchiveWriter the file was written with
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT filename, size, state FROM invoices WHERE invoicenr = ?',
+                                           (invoice[u'invoicenr'],)).fetchone()
+        if row is None:
+            return False
+        recorded_filename, size, state = row
+        return (recorded_filename == filename and state == self.state(invoice) and
+                writer.contains(filename, size))
+
+    def record(self, invoice, filename, size, checksum):
+        """record that an invoice has been written to filename
+
+        :param invoice: invoice dict as returned by the API
+        :param filename: file the invoice is saved in
+        :param size: size of the file
+        :param checksum: sha256 checksum of the file
+        """
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO invoices VALUES (?, ?, ?, ?, ?, ?)',
+                                     (invoice[u'invoicenr'], filename, size, checksum,
+                                      self.state(invoice), time.time()))
+            self._connection.commit()
+
+    def close(self):
+        """close the manifest"""
+        self._connection.close()
+
+
+class BatchedWriter:
+    """
+    write files atomically, and sync them to disk in batches
+
+    Each file is written to a temporary file next to it, which per batch of
+    files is synced to disk and only then renamed to the final name, so a crash
+    never leaves a truncated file under the final name. Syncing the directories
+    is done once per batch. Only once a batch is on disk, the callbacks of its
+    files are called (used to record them in the manifest), so a crash before
+    that just means those files are downloaded again.
+    """
+
+    def __init__(self, batchsize):
+        """
+        :param batchsize: number of files to sync at once; 0 to not sync at all
+        """
+        self._batchsize = batchsize
+        self._lock = threading.Lock()
+        self._pending = []
+
+    def write(self, filename, content, callback):
+        """write content to filename
+
+        :param filename: name of the file
+        :param content: content of the file
+        :param callback: function to call once the file is synced to disk
+        """
+        mkdir_p(os.path.dirname(filename) or '.')
+        with open(filename + '.part', 'wb') as f:
+            f.write(content)
+        batch = None
+        with self._lock:
+            self._pending.append((filename, callback))
+            if len(self._pending) >= self._batchsize:
+                batch, self._pending = self._pending, []
+        if batch:
+            self._sync(batch)
+
+    def contains(self, filename, size):
+        """return True when filename exists and has the given size
+
+        :param filename: name of the file
+        :param size: expected size
+        """
+        return os.path.exists(filename) and os.path.getsize(filename) == size
+
+    def flush(self):
+        """sync all files that have not been synced yet"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if batch:
+            self._sync(batch)
+
+    def _sync(self, batch):
+        """sync files to disk and rename them to their final names, sync their
+        directories, then call their callbacks
+
+        :param batch: list of (filename, callback) tuples
+        """
+        directories = set()
+        for filename, callback in batch:
+            if self._batchsize:
+                fsync_path(filename + '.part')
+            os.rename(filename + '.part', filename)
+            directories.add(os.path.dirname(filename) or '.')
+        if self._batchsize:
+            for directory in directories:
+                fsync_path(directory)
+        for filename, callback in batch:
+            callback()
+
+
+class ArchiveWriter:
+    """
+    write files into zip or tar archives instead of to separate files
+
+    A filename like 'invoices/2013.zip/F001.pdf' means member F001.pdf of the
+    archive invoices/2013.zip. Existing archives are added to; an invoice that
+    changed is added again, and unpacking takes the last copy. The first file
+    for an archive copies it to a temporary file next to it, and all files are
+    added to that copy. Only on flush the copy is closed (which for zip writes
+    the table of contents), synced to disk and renamed over the archive, and
+    the files are recorded via the callbacks; so each archive is copied once
+    per run instead of rewritten per batch, and a crash leaves the archive as
+    it was before the run. An archive that cannot be read is moved aside to a
+    name ending in '.damaged' and started again.
+    """
+
+    def __init__(self, kind, batchsize, readonly=False):
+        """
+        :param kind: 'zip' or 'tar'
+        :param batchsize: 0 to not sync the archives to disk (as for BatchedWriter)
+        :param readonly: only read the archives (for a dry run); an archive that cannot be read counts as empty
+        """
+        self._kind = kind
+        self._batchsize = batchsize
+        self._readonly = readonly
+        self._lock = threading.Lock()
+        self._archives = {}
+        self._members = {}
+        self._pending = []
+
+    def _members_of(self, path):
+        """return dict with size per member of an archive (call with lock held)
+
+        :param path: name of the archive
+        """
+        if path not in self._members:
+            self._members[path] = {}
+            if os.path.exists(path):
+                try:
+                    if self._kind == 'zip':
+                        with zipfile.ZipFile(path) as archive:
+                            for info in archive.infolist():
+                                self._members[path][info.filename] = info.file_size
+                    else:
+                        archive = tarfile.open(path)
+                        for info in archive.getmembers():
+                            self._members[path][info.name] = info.size
+                        archive.close()
+                except (zipfile.BadZipfile, tarfile.TarError):
+                    # its invoices are downloaded again into a new archive
+                    if not self._readonly:
+                        os.rename(path, path + '.damaged')
+                    self._members[path] = {}
+        return self._members[path]
+
+    def contains(self, filename, size):
+        """return True when the archive holds the member with the given size
+
+        :param filename: name of the archive and member, like 'invoices/2013.zip/F001.pdf'
+        :param size: expected size
+        """
+        path, name = os.path.split(filename)
+        with self._lock:
+            return self._members_of(path).get(name) == size
+
+    def write(self, filename, content, callback):
+        """add content to an archive
+
+        :param filename: name of the archive and member, like 'invoices/2013.zip/F001.pdf'
+        :param content: content of the member
+        :param callback: function to call once the archive is closed, synced to disk and in place
+        """
+        path, name = os.path.split(filename)
+        with self._lock:
+            members = self._members_of(path)
+            if path not in self._archives:
+                temporary = path + '.part'
+                if os.path.exists(path):
+                    shutil.copyfile(path, temporary)
+                elif os.path.exists(temporary):
+                    # left behind by an earlier run that crashed
+                    os.remove(temporary)
+                if self._kind == 'zip':
+                    self._archives[path] = zipfile.ZipFile(temporary, 'a' if os.path.exists(temporary) else 'w',
+                                                           zipfile.ZIP_DEFLATED, allowZip64=True)
+                else:
+                    self._archives[path] = tarfile.open(temporary, 'a')
+            archive = self._archives[path]
+            if self._kind == 'zip':
+                info = zipfile.ZipInfo(name, time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = 0644 << 16
+                archive.writestr(info, content)
+            else:
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                info.mtime = time.time()
+                archive.addfile(info, StringIO.StringIO(content))
+            members[name] = len(content)
+            self._pending.append(callback)
+
+    def flush(self):
+        """close and sync all archives"""
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        """close all open archives, sync them to disk, put them in place and call the callbacks
+        (call with lock held)"""
+        for path, archive in self._archives.items():
+            archive.close()
+            if self._batchsize:
+                fsync_path(path + '.part')
+            os.rename(path + '.part', path)
+            if self._batchsize:
+                fsync_path(os.path.dirname(path) or '.')
+        self._archives = {}
+        callbacks, self._pending = self._pending, []
+        for callback in callbacks:
+            callback()
+
+
+def fsync_path(path):
+    """sync a file or directory to disk
+
+    :param path: name of the file or directory
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Progress:
+    """
+    counters and timers of a download run
+
+    Time is kept per stage: listing the invoices, conversion (deciding what to
+    download, checksums), network (downloading the PDFs) and disk (writing and
+    syncing). With more than one worker, network and disk time add up over the
+    workers, so they can be more than the time the run took.
+    """
+    STAGES = ['listing', 'conversion', 'network', 'disk']
+
+    def __init__(self, fact):
+        """
+        :param fact: factuursturen.Client, to report the remaining API calls of
+        """
+        self._fact = fact
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._stages = dict((stage, 0.0) for stage in self.STAGES)
+        self.total = 0
+        self.files = 0
+        self.bytes = 0
+        self.calls = 0
+
+    def add(self, stage, seconds):
+        """add time spent in a stage
+
+        :param stage: one of STAGES
+        :param seconds: time spent
+        """
+        with self._lock:
+            self._stages[stage] += seconds
+
+    def called(self):
+        """count an API call"""
+        with self._lock:
+            self.calls += 1
+
+    def downloaded(self, size):
+        """count a downloaded file
+
+        :param size: size of the file
+        """
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+
+    def status(self):
+        """return a line with throughput, remaining API calls and ETA"""
+        elapsed = max(time.time() - self._start, 0.001)
+        rate = self.files / elapsed
+        if rate and self.total > self.files:
+            eta = '{:.0f}s'.format((self.total - self.files) / rate)
+        else:
+            eta = 'unknown' if self.total > self.files else '0s'
+        return ('{}/{} files, {:.1f} files/s, {:.2f} MB/s, {:.1f} calls/s, {} calls remaining, '
+                'ETA {}'.format(self.files, self.total, rate, self.bytes / elapsed / 1e6, self.calls / elapsed,
+                                self._fact.remaining, eta))
+
+    def summary(self):
+        """return lines summarizing the run, with the time spent per stage"""
+        elapsed = time.time() - self._start
+        lines = ['{} files ({:.1f} MB) downloaded in {:.1f}s with {} API calls'.format(
+            self.files, self.bytes / 1e6, elapsed, self.calls)]
+        for stage in self.STAGES:
+            lines.append('  {:<10} {:8.1f}s'.format(stage, self._stages[stage]))
+        return lines
+
+
+def download(fact, invoice, filename, manifest, writer, progress, logger):
+    """download a single invoice, write it to filename and record it in the manifest
+
+    :param fact: factuursturen.Client
+    :param invoice: invoice dict as returned by the API
+    :param filename: file to write the invoice to
+    :param manifest: Manifest
+    :param writer: BatchedWriter or ArchiveWriter
+    :param progress: Progress
+    :param logger: logger
+    """
+    invoicenr = invoice[u'invoicenr']
+    try:
+        logger.debug("trying to get invoice {}".format(invoicenr))
+        start = time.time()
+        try:
+            pdf = fact.get('invoices_pdf', invoicenr)
+        finally:
+            progress.called()
+            progress.add('network', time.time() - start)
+        start = time.time()
+        record = functools.partial(manifest.record, invoice, filename, len(pdf), hashlib.sha256(pdf).hexdigest())
+        progress.add('conversion', time.time() - start)
+        start = time.time()
+        writer.write(filename, pdf, record)
+        progress.add('disk', time.time() - start)
+        progress.downloaded(len(pdf))
+        logger.debug("written file {}".format(filename))
+    except factuursturen.FactuursturenEmptyResult:
+        logger.debug("factuur {} is empty".format(invoicenr))
+    except factuursturen.FactuursturenNotFound:
+        logger.error("invoice {} not found".format(invoicenr))
+    except factuursturen.FactuursturenNoMoreApiCalls:
+        logger.warning("no more remaining API calls, invoice {} not downloaded yet".format(invoicenr))
+        raise
+    finally:
+        logger.debug("API calls remaining: {}".format(fact.remaining))
+
+
+def plan_windows(calls, remaining, limit):
+    """divide calls over rate limit windows of an hour
+
+    returns a list with the number of calls to make in each window, starting with the current one
+
+    :param calls: number of calls to make
+    :param remaining: calls left in the current window
+    :param limit: calls allowed in a full window
+    """
+    windows = [min(calls, max(remaining, 0))]
+    calls -= windows[0]
+    while calls > 0:
+        windows.append(min(calls, limit))
+        calls -= windows[-1]
+    return windows
+
+
+def parse_shard(value):
+    """parse a shard like '2/4' into (2, 4)
+
+    raises ValueError when value is not a valid shard
+
+    :param value: string like 'I/N'
+    """
+    try:
+        shard, shards = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise ValueError('shard should look like I/N, for instance 1/4')
+    if not 1 <= shard <= shards:
+        raise ValueError('shard I/N should have I from 1 to N')
+    return shard, shards
+
+
+def in_shard(invoice, shard, shard_by):
+    """return True when an invoice belongs to a shard
+
+    The partitioning only depends on the invoice, so every process (on any
+    host) agrees on it and no invoice is downloaded by two shards.
+
+    :param invoice: invoice dict as returned by the API
+    :param shard: (I, N) tuple, or None to download everything
+    :param shard_by: 'hash' or 'year'
+    """
+    if shard is None:
+        return True
+    number, shards = shard
+    if shard_by == 'year':
+        key = invoice[u'sent'].year
+    else:
+        key = zlib.crc32(invoice[u'invoicenr'].encode('utf-8')) & 0xffffffff
+    return key % shards == number - 1
+
+
+def next_poll(interval, found, remaining, shortest, longest, wait):
+    """return the number of seconds to wait before listing the invoices again
+
+    The interval halves when new invoices were found and doubles when none
+    were, between shortest and longest. Polling never uses more than half of
+    the remaining API calls of the hour, so downloads keep room.
+
+    :param interval: seconds waited before the last poll
+    :param found: number of new or changed invoices found by the last poll
+    :param remaining: remaining API calls, or None when unknown
+    :param shortest: shortest interval in seconds
+    :param longest: longest interval in seconds
+    :param wait: seconds to wait when no API calls are left
+    """
+    if found:
+        interval /= 2.0
+    else:
+        interval *= 2.0
+    interval = min(max(interval, shortest), longest)
+    if remaining is not None:
+        if remaining <= 0:
+            return max(interval, wait)
+        interval = max(interval, 3600.0 / max(remaining // 2, 1))
+    return interval
+
+
+def download_all(fact, jobs, writer, progress, logger, workers=1, wait=0):
+    """run the download jobs, waiting for new API calls when they are used up
+
+    Every invoice that could not be downloaded is logged as an error.
+
+    returns the number of invoices that were not downloaded
+
+    :param fact: factuursturen.Client
+    :param jobs: list of (invoicenr, job) tuples, see Client.run_many
+    :param writer: BatchedWriter or ArchiveWriter
+    :param progress: Progress
+    :param logger: logger
+    :param workers: number of concurrent downloads
+    :param wait: seconds to wait for new API calls when they are used up (0: stop)
+    """
+    # the downloads share one client, and with it its connections and remaining API calls
+    failed = 0
+    try:
+        while jobs:
+            jobs = dict(jobs)
+            left = []
+            for invoicenr, result in fact.run_many(jobs.items(), workers):
+                if isinstance(result, factuursturen.FactuursturenNoMoreApiCalls):
+                    left.append((invoicenr, jobs[invoicenr]))
+                elif isinstance(result, factuursturen.FactuursturenError):
+                    failed += 1
+                    logger.error("invoice {} not downloaded: {}".format(invoicenr, result))
+            jobs = left
+            if jobs and not wait:
+                failed += len(jobs)
+                logger.error("no more remaining API calls, {} invoices not downloaded".format(len(jobs)))
+                break
+            if jobs:
+                logger.warning("no more remaining API calls, waiting {} seconds before downloading the "
+                               "{} invoices left".format(wait, len(jobs)))
+                start = time.time()
+                writer.flush()
+                progress.add('disk', time.time() - start)
+                time.sleep(wait)
+                # unknown until the next call tells; when the window has not been
+                # reset yet, that call fails and we wait again
+                fact._remaining = None
+    finally:
+        start = time.time()
+        writer.flush()
+        progress.add('disk', time.time() - start)
+    return failed
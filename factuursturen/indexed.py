@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+a list of objects with indexes on their fields
+
+Client.get(function, indexed=True) returns an IndexedList. It is an ordinary
+list, but finding objects by the value of a field or by a range of values
+uses an index instead of a scan over all objects. An index is built the first
+time a field is searched and kept until the list changes.
+
+"""
+import bisect
+
+__author__ = 'Reinoud van Leeuwen'
+__copyright__ = "Copyright 2013, Reinoud van Leeuwen"
+__license__ = "BSD"
+__maintainer__ = "Reinoud van Leeuwen"
+__email__ = "reinoud.v@n.leeuwen.net"
+
+
+class IndexedList(list):
+    """
+    list of dicts with hash and sorted indexes on their fields
+    """
+
+    def __init__(self, records=(), function=None):
+        """
+        :param records: dicts, as returned by Client.get
+        :param function: callable function from the API the records came from ('clients', 'invoices', etc)
+        """
+        list.__init__(self, records)
+        self.function = function
+        self._hashindexes = {}
+        self._sortedindexes = {}
+
+    def find(self, field, value):
+        """return the objects whose field equals value, in the order of the list
+
+        The first search on a field builds a hash index on it, after that a
+        search takes constant time.
+
+        :param field: name of the field
+        :param value: value to look for
+        """
+        index = self._hashindexes.get(field)
+        if index is None:
+            index = {}
+            for record in self:
+                index.setdefault(record.get(field), []).append(record)
+            self._hashindexes[field] = index
+        return list(index.get(value, []))
+
+    def find_one(self, field, value):
+        """return the first object whose field equals value, or None
+
+        Meant for fields identifying an object, like 'invoicenr' or 'clientnr'.
+
+        :param field: name of the field
+        :param value: value to look for
+        """
+        found = self.find(field, value)
+        return found[0] if found else None
+
+    def between(self, field, low=None, high=None):
+        """return the objects with low <= field <= high, sorted on field
+
+        Objects without a value for the field (like an invoice that was not paid
+        yet, for paiddate) are never returned. The first search on a field builds
+        a sorted index on it, after that a search takes logarithmic time (plus
+        the number of objects returned).
+
+        :param field: name of the field, usually a date, float or int field from CONVERTABLEFIELDS
+        :param low: lowest value to return (None: no lower bound)
+        :param high: highest value to return (None: no upper bound)
+        """
+        index = self._sortedindexes.get(field)
+        if index is None:
+            pairs = sorted(((record[field], position) for position, record in enumerate(self)
+                            if record.get(field) not in (None, '')))
+            index = ([value for value, position in pairs], [self[position] for value, position in pairs])
+            self._sortedindexes[field] = index
+        keys, records = index
+        start = 0 if low is None else bisect.bisect_left(keys, low)
+        end = len(keys) if high is None else bisect.bisect_right(keys, high)
+        return records[start:end]
+
+    def reindex(self):
+        """drop all indexes, so they are built again on the next search
+
+        Needed after changing the value of an indexed field in one of the
+        objects; changes to the list itself drop the indexes automatically.
+        """
+        self._hashindexes = {}
+        self._sortedindexes = {}
+
+    # all methods that change which objects are in the list drop the indexes
+    def append(self, record):
+        self.reindex()
+        list.append(self, record)
+
+    def extend(self, records):
+        self.reindex()
+        list.extend(self, records)
+
+    def insert(self, position, record):
+        self.reindex()
+        list.insert(self, position, record)
+
+    def remove(self, record):
+        self.reindex()
+        list.remove(self, record)
+
+    def pop(self, *args):
+        self.reindex()
+        return list.pop(self, *args)
+
+    def __setitem__(self, key, value):
+        self.reindex()
+        list.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.reindex()
+        list.__delitem__(self, key)
+
+    def __setslice__(self, start, end, records):
+        self.reindex()
+        list.__setslice__(self, start, end, records)
+
+    def __delslice__(self, start, end):
+        self.reindex()
+        list.__delslice__(self, start, end)
+
+    def __iadd__(self, records):
+        self.reindex()
+        return list.__iadd__(self, records)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+a write-ahead journal for bulk operations (post_many, put_many, delete_many)
+
+Before each call the intent is recorded, after it the outcome. When a bulk
+operation is run again with the same journal, items that were completed are
+not sent again, so an interrupted import can simply be restarted. Every entry
+holds the run (one bulk operation) that last used it, so once a bulk operation
+completed without errors, its entries are removed again.
+
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+import uuid
+
+__author__ = 'Reinoud van Leeuwen'
+__copyright__ = "Copyright 2013, Reinoud van Leeuwen"
+__license__ = "BSD"
+__maintainer__ = "Reinoud van Leeuwen"
+__email__ = "reinoud.v@n.leeuwen.net"
+
+
+class Journal:
+    """
+    journal of bulk calls, kept in an SQLite database
+    """
+
+    def __init__(self, filename):
+        """
+        open (or create) the journal
+
+        :param filename: name of the SQLite database file
+        """
+        # the journal is written from the worker threads of the bulk calls
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS entries ('
+                                 ' key TEXT PRIMARY KEY,'
+                                 ' verb TEXT,'
+                                 ' function TEXT,'
+                                 ' objid TEXT,'
+                                 ' state TEXT,'
+                                 ' result TEXT,'
+                                 ' updated REAL,'
+                                 ' run TEXT)')
+        columns = [row[1] for row in self._connection.execute('PRAGMA table_info(entries)')]
+        if 'run' not in columns:
+            # journal written before runs were recorded
+            self._connection.execute('ALTER TABLE entries ADD COLUMN run TEXT')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS entries_run ON entries (run)')
+        self._connection.commit()
+
+    @staticmethod
+    def new_run():
+        """return a new, unique id for a run"""
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def key(verb, function, objId, body, occurrence):
+        """return the key of an item in a bulk call
+
+        The key is based on the content of the call, so the same item in a rerun
+        gets the same key. occurrence tells apart identical items in one bulk call.
+
+        :param verb: 'post', 'put' or 'delete'
+        :param function: callable function from the API ('clients', 'products', etc)
+        :param objId: id of the object (None for posts)
+        :param body: encoded body of the call (None for deletes)
+        :param occurrence: number of identical items before this one in the bulk call
+        """
+        # the order of the fields in an encoded body depends on the dict it came from
+        if isinstance(body, basestring):
+            body = '&'.join(sorted(body.split('&')))
+        digest = hashlib.sha1(repr((verb, function, objId, body))).hexdigest()
+        return '{}-{}'.format(digest, occurrence)
+
+    def lookup(self, key):
+        """return (state, result) of an item, or None when it is not in the journal
+
+        state is 'pending' when the call was started but its outcome was never
+        recorded, 'done' when it succeeded and 'failed' when it did not.
+
+        :param key: key of the item, see key()
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT state, result FROM entries WHERE key = ?',
+                                           (key,)).fetchone()
+        return tuple(row) if row else None
+
+    def begin(self, key, verb, function, objId, run=None):
+        """record that a call is about to be made
+
+        :param key: key of the item, see key()
+        :param verb: 'post', 'put' or 'delete'
+        :param function: callable function from the API ('clients', 'products', etc)
+        :param objId: id of the object (None for posts)
+        :param run: id of the run making the call, see new_run()
+        """
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                     (key, verb, function, objId, 'pending', None, time.time(), run))
+            self._connection.commit()
+
+    def claim(self, key, run):
+        """record that an item done in an earlier run is part of this run as well
+
+        :param key: key of the item, see key()
+        :param run: id of the run, see new_run()
+        """
+        with self._lock:
+            self._connection.execute('UPDATE entries SET run = ? WHERE key = ?', (run, key))
+            self._connection.commit()
+
+    def finish(self, key, state, result):
+        """record the outcome of a call
+
+        :param key: key of the item, see key()
+        :param state: 'done' or 'failed'
+        :param result: value returned by the call, or the error message
+        """
+        with self._lock:
+            self._connection.execute('UPDATE entries SET state = ?, result = ?, updated = ? WHERE key = ?',
+                                     (state, result, time.time(), key))
+            self._connection.commit()
+
+    def pending(self):
+        """return (key, verb, function, objid) of calls whose outcome is unknown
+
+        These were interrupted while in progress; posts among them are not
+        retried, because the object might have been created already.
+        """
+        with self._lock:
+            return [tuple(row) for row in
+                    self._connection.execute("SELECT key, verb, function, objid FROM entries"
+                                             " WHERE state = 'pending'")]
+
+    def forget(self, key):
+        """remove an item from the journal, so it will be sent again
+
+        :param key: key of the item, see key()
+        """
+        with self._lock:
+            self._connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self._connection.commit()
+
+    def forget_run(self, run):
+        """remove the items of a run from the journal, so they will be sent again
+
+        :param run: id of the run, see new_run()
+        """
+        with self._lock:
+            self._connection.execute('DELETE FROM entries WHERE run = ?', (run,))
+            self._connection.commit()
+
+    def close(self):
+        """close the journal"""
+        self._connection.close()
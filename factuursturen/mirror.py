@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""
+a local copy of the data in the API, kept in an SQLite database
+
+Every getter gets a table with a column per field, typed according to
+CONVERTABLEFIELDS. A refresh gets all objects again and only writes the
+differences with the previous copy, so the database can be queried as often
+as needed without spending API calls.
+
+"""
+from datetime import datetime
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import factuursturen
+
+__author__ = 'Reinoud van Leeuwen'
+__copyright__ = "Copyright 2013, Reinoud van Leeuwen"
+__license__ = "BSD"
+__maintainer__ = "Reinoud van Leeuwen"
+__email__ = "reinoud.v@n.leeuwen.net"
+
+# field identifying an object per getter, for the getters that return a list
+# and are mirrored by default. Objects of other getters (or without this field)
+# are identified by their content. 'balance' returns a single object and
+# cannot be mirrored
+MIRRORKEYS = {'clients': 'clientnr',
+              'products': 'id',
+              'invoices': 'invoicenr',
+              'invoices_saved': 'id',
+              'invoices_repeated': 'id',
+              'profiles': 'id',
+              'countrylist': 'id',
+              'taxes': 'percentage'}
+
+# SQLite type per field type. Fields not in CONVERTABLEFIELDS are stored as
+# text, or as JSON text when they hold a list or dict
+SQLTYPES = {'int': 'INTEGER',
+            'float': 'REAL',
+            'bool': 'INTEGER',
+            'date': 'TEXT',
+            'text': 'TEXT',
+            'json': 'TEXT'}
+
+
+class Mirror:
+    """
+    local copy of the getters of the API
+    """
+
+    def __init__(self, filename):
+        """
+        open (or create) the mirror
+
+        :param filename: name of the SQLite database file
+        """
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS _columns ('
+                                 ' function TEXT,'
+                                 ' name TEXT,'
+                                 ' type TEXT,'
+                                 ' PRIMARY KEY (function, name))')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS _snapshots ('
+                                 ' function TEXT PRIMARY KEY,'
+                                 ' refreshed REAL,'
+                                 ' count INTEGER)')
+        self._connection.commit()
+        self._columns = {}
+        for row in self._connection.execute('SELECT function, name, type FROM _columns'):
+            self._columns.setdefault(row['function'], {})[row['name']] = row['type']
+
+    def refresh(self, fact, functions=None):
+        """get the objects of the getters from the API and update the copy
+
+        Uses one API call per getter. returns a dict with the report of
+        update() per getter.
+
+        :param fact: factuursturen.Client
+        :param functions: list of getters to refresh (default: the getters in MIRRORKEYS)
+        """
+        reports = {}
+        for function in functions or [function for function in factuursturen.API['getters']
+                                      if function in MIRRORKEYS]:
+            reports[function] = self.update(function, fact.get(function))
+        return reports
+
+    def update(self, function, records):
+        """make the copy of a getter match a complete list of its objects
+
+        Objects are compared with the previous copy by a hash of their values:
+        only new, changed and removed objects are written.
+
+        returns a dict with the number of objects inserted, updated, deleted and unchanged
+
+        :param function: getter from the API ('clients', 'products', etc)
+        :param records: all objects, as returned by Client.get
+        """
+        rows = {}
+        for record in records:
+            self._add_columns(function, record)
+            row = dict((name, self._to_sql(function, name, value)) for name, value in record.iteritems())
+            digest = hashlib.sha1(repr(sorted(row.iteritems()))).hexdigest()
+            keyfield = MIRRORKEYS.get(function)
+            if keyfield and row.get(keyfield) not in (None, ''):
+                key = unicode(row[keyfield])
+            else:
+                key = digest
+            rows[key] = (digest, row)
+
+        report = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+        table = self._quote(function)
+        with self._lock:
+            self._create_table(function)
+            known = dict(self._connection.execute('SELECT _key, _hash FROM {}'.format(table)))
+            for key, (digest, row) in rows.iteritems():
+                if key not in known:
+                    report['inserted'] += 1
+                elif known[key] != digest:
+                    report['updated'] += 1
+                else:
+                    report['unchanged'] += 1
+                    continue
+                names = ['_key', '_hash'] + sorted(row)
+                values = [key, digest] + [row[name] for name in names[2:]]
+                # columns missing from the object are reset to NULL
+                self._connection.execute('DELETE FROM {} WHERE _key = ?'.format(table), (key,))
+                self._connection.execute('INSERT INTO {} ({}) VALUES ({})'.format(
+                    table, ', '.join(self._quote(name) for name in names), ', '.join('?' * len(names))), values)
+            for key in known:
+                if key not in rows:
+                    self._connection.execute('DELETE FROM {} WHERE _key = ?'.format(table), (key,))
+                    report['deleted'] += 1
+            self._connection.execute('INSERT OR REPLACE INTO _snapshots VALUES (?, ?, ?)',
+                                     (function, time.time(), len(rows)))
+            self._connection.commit()
+        return report
+
+    def find(self, function, order_by=None, **filters):
+        """return the objects of a getter whose fields equal the given values
+
+        Values are returned with the same types as Client.get returns them.
+
+        :param function: getter from the API ('clients', 'products', etc)
+        :param order_by: field to sort on
+        :param filters: field=value pairs the objects have to match
+        """
+        columns = self._columns.get(function)
+        if columns is None:
+            return []
+        statement = 'SELECT * FROM {}'.format(self._quote(function))
+        names = sorted(filters)
+        for name in names:
+            if name not in columns:
+                raise factuursturen.FactuursturenWrongCall('{} has no field {}'.format(function, name))
+        if names:
+            statement += ' WHERE ' + ' AND '.join('{} IS ?'.format(self._quote(name)) for name in names)
+        if order_by is not None:
+            if order_by not in columns:
+                raise factuursturen.FactuursturenWrongCall('{} has no field {}'.format(function, order_by))
+            statement += ' ORDER BY {}'.format(self._quote(order_by))
+        params = [self._to_sql(function, name, filters[name]) for name in names]
+        with self._lock:
+            rows = self._connection.execute(statement, params).fetchall()
+        return [self._from_row(function, row) for row in rows]
+
+    def query(self, statement, params=()):
+        """run an SQL query on the copy and return the rows as dicts
+
+        Each getter is a table named after it, with a column per field. Values
+        are returned as SQLite stores them: dates as 'YYYY-MM-DD' text and
+        booleans as 0 or 1.
+
+        :param statement: SQL statement
+        :param params: values for the placeholders in statement
+        """
+        with self._lock:
+            return [dict(zip(row.keys(), row)) for row in self._connection.execute(statement, params)]
+
+    def refreshed(self, function):
+        """return when a getter was refreshed last (as a timestamp), or None when it never was
+
+        :param function: getter from the API ('clients', 'products', etc)
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT refreshed FROM _snapshots WHERE function = ?',
+                                           (function,)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        """close the mirror"""
+        self._connection.close()
+
+    def _create_table(self, function):
+        """create the table of a getter, or add the columns it is missing"""
+        table = self._quote(function)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS {} (_key TEXT PRIMARY KEY, _hash TEXT)'.format(table))
+        existing = set(row[1] for row in self._connection.execute('PRAGMA table_info({})'.format(table)))
+        for name, fieldtype in sorted(self._columns.get(function, {}).iteritems()):
+            if name not in existing:
+                self._connection.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    table, self._quote(name), SQLTYPES[fieldtype]))
+                self._connection.execute('INSERT OR REPLACE INTO _columns VALUES (?, ?, ?)',
+                                         (function, name, fieldtype))
+
+    def _add_columns(self, function, record):
+        """register the fields of a record that have not been seen before"""
+        columns = self._columns.setdefault(function, {})
+        for name, value in record.iteritems():
+            if name not in columns:
+                if name in factuursturen.CONVERTABLEFIELDS.get(function, {}):
+                    columns[name] = factuursturen.CONVERTABLEFIELDS[function][name]
+                elif isinstance(value, (dict, list)):
+                    columns[name] = 'json'
+                else:
+                    columns[name] = 'text'
+
+    def _to_sql(self, function, name, value):
+        """return a value as it is stored in the database"""
+        fieldtype = self._columns.get(function, {}).get(name, 'text')
+        if value is None or value == '':
+            return None
+        if fieldtype == 'json':
+            return json.dumps(value, sort_keys=True)
+        if fieldtype == 'date' and isinstance(value, datetime):
+            return value.strftime('%Y-%m-%d')
+        if fieldtype == 'bool':
+            return int(bool(value))
+        return value
+
+    def _from_row(self, function, row):
+        """return a row of the database as a dict with the types of Client.get"""
+        columns = self._columns[function]
+        record = {}
+        for name in row.keys():
+            if name in ('_key', '_hash'):
+                continue
+            value = row[name]
+            fieldtype = columns.get(name)
+            if value is not None:
+                if fieldtype == 'json':
+                    value = json.loads(value)
+                elif fieldtype == 'date':
+                    value = datetime.strptime(value, '%Y-%m-%d')
+                elif fieldtype == 'bool':
+                    value = bool(value)
+            record[name] = value
+        return record
+
+    @staticmethod
+    def _quote(name):
+        """quote a table or column name"""
+        return '"{}"'.format(name.replace('"', '""'))
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+"""
+a local fuzzy search index over clients or products
+
+The text fields of each object (see SEARCHFIELDS) are split into trigrams:
+every sequence of three characters of each word, with the start and end of a
+word marked, so 'Bravo' gives '  b', ' br', 'bra', 'rav', 'avo' and 'vo '.
+A query is split the same way and objects are ranked by how many of its
+trigrams they share. Because words are marked at their start, the first
+letters typed already find the objects with words starting with them, and
+small typos still give a match.
+
+Queries of one or two letters match so many objects that counting their
+trigrams takes milliseconds. For those, the objects with a word starting with
+the query are kept per prefix, shortest text first, and the first ones are
+returned directly.
+
+"""
+import bisect
+import collections
+import heapq
+import re
+import unicodedata
+import factuursturen
+
+__author__ = 'Reinoud van Leeuwen'
+__copyright__ = "Copyright 2013, Reinoud van Leeuwen"
+__license__ = "BSD"
+__maintainer__ = "Reinoud van Leeuwen"
+__email__ = "reinoud.v@n.leeuwen.net"
+
+# number of search results kept for repeated queries
+CACHESIZE = 1024
+
+# queries up to this length are answered from the prefixes of the words
+PREFIXLENGTH = 2
+
+# fields searched per function
+SEARCHFIELDS = {'clients': ['company', 'contact', 'city'],
+                'products': ['code', 'name']}
+
+
+class SearchIndex:
+    """
+    trigram index over the text fields of clients or products
+    """
+
+    def __init__(self, function, records=(), fields=None):
+        """
+        :param function: 'clients' or 'products'
+        :param records: objects to index, as returned by Client.get
+        :param fields: fields to search (default: SEARCHFIELDS for the function)
+        """
+        if function not in factuursturen.SYNCIDFIELDS:
+            raise factuursturen.FactuursturenWrongCall('search is only available for {}'.format(
+                ', '.join(factuursturen.SYNCIDFIELDS)))
+        self.function = function
+        self._idfield = factuursturen.SYNCIDFIELDS[function]
+        self._fields = fields or SEARCHFIELDS[function]
+        # trigram -> set of ids, and per id the object and its normalized text
+        self._postings = {}
+        self._records = {}
+        self._texts = {}
+        # prefix of a word -> (length of text, id) of the objects with such a
+        # word, kept sorted
+        self._prefixes = {}
+        # ids found by recent searches, dropped whenever the index changes. Short
+        # prefixes match many objects and are typed over and over. Ids, not the
+        # objects, so an object replaced by update() is returned as it is now
+        self._cache = {}
+        # sorting the lists once is faster than keeping them sorted while they grow
+        for record in records:
+            self._add(record, list.append)
+        for entries in self._prefixes.itervalues():
+            entries.sort()
+
+    def __len__(self):
+        return len(self._records)
+
+    def add(self, record):
+        """add an object to the index, or replace the object with the same id
+
+        :param record: dict, as returned by Client.get
+        """
+        self._add(record, bisect.insort)
+
+    def _add(self, record, insert):
+        """add an object to the index, putting its entries in the prefix lists with insert"""
+        objId = record[self._idfield]
+        if objId in self._records:
+            self.remove(objId)
+        self._cache.clear()
+        text = self._normalize(u' '.join(unicode(record.get(field) or u'') for field in self._fields))
+        self._records[objId] = record
+        self._texts[objId] = text
+        for trigram in self._trigrams(text):
+            self._postings.setdefault(trigram, set()).add(objId)
+        for prefix in self._prefixes_of(text):
+            insert(self._prefixes.setdefault(prefix, []), (len(text), objId))
+
+    def remove(self, objId):
+        """remove an object from the index
+
+        :param objId: id of the object ('clientnr' for clients, 'id' for products)
+        """
+        del self._records[objId]
+        self._cache.clear()
+        text = self._texts.pop(objId)
+        for trigram in set(self._trigrams(text)):
+            postings = self._postings[trigram]
+            postings.discard(objId)
+            if not postings:
+                del self._postings[trigram]
+        for prefix in self._prefixes_of(text):
+            entries = self._prefixes[prefix]
+            entries.remove((len(text), objId))
+            if not entries:
+                del self._prefixes[prefix]
+
+    def update(self, records):
+        """make the index match a complete list of objects
+
+        Only objects that are new, removed or changed in one of the searched
+        fields are indexed again.
+
+        returns a dict with the number of objects inserted, updated, deleted and unchanged
+
+        :param records: all objects, as returned by Client.get
+        """
+        report = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+        seen = set()
+        for record in records:
+            objId = record[self._idfield]
+            seen.add(objId)
+            old = self._records.get(objId)
+            if old is None:
+                report['inserted'] += 1
+            elif any(old.get(field) != record.get(field) for field in self._fields):
+                report['updated'] += 1
+            else:
+                # keep the newest object, its other fields may have changed
+                self._records[objId] = record
+                report['unchanged'] += 1
+                continue
+            self.add(record)
+        for objId in [objId for objId in self._records if objId not in seen]:
+            self.remove(objId)
+            report['deleted'] += 1
+        return report
+
+    def refresh(self, fact):
+        """get all objects from the API (one call) and update the index with them
+
+        :param fact: factuursturen.Client
+        """
+        return self.update(fact.get(self.function))
+
+    def search(self, query, limit=10):
+        """return the objects best matching a query, best first
+
+        Objects sharing at least half of the trigrams of the query are
+        returned. They are ranked by the number of shared trigrams, then
+        objects containing the query literally come first, then shorter texts.
+        For a single word of up to PREFIXLENGTH characters, the objects with a
+        word starting with it are returned, shorter texts first.
+
+        :param query: text typed so far
+        :param limit: maximum number of objects to return
+        """
+        text = self._normalize(query)
+        if (text, limit) in self._cache:
+            return [self._records[objId] for objId in self._cache[(text, limit)]]
+        if 0 < len(text) <= PREFIXLENGTH and u' ' not in text:
+            return [self._records[objId] for length, objId in self._prefixes.get(text, [])[:limit]]
+        trigrams = set(self._trigrams(text))
+        if not trigrams:
+            return []
+        needed = (len(trigrams) + 1) // 2
+        postings = sorted((self._postings.get(trigram, frozenset()) for trigram in trigrams), key=len)
+        # an object sharing `needed` trigrams shares at least one of the
+        # len(trigrams) - needed + 1 rarest ones, so only those are scanned;
+        # the more common ones are only checked for the candidates found
+        scanned = len(trigrams) - needed + 1
+        counts = {}
+        for objIds in postings[:scanned]:
+            for objId in objIds:
+                counts[objId] = counts.get(objId, 0) + 1
+        for objIds in postings[scanned:]:
+            for objId in objIds.intersection(counts):
+                counts[objId] += 1
+        bycount = collections.defaultdict(list)
+        for objId, count in counts.iteritems():
+            if count >= needed:
+                bycount[count].append(objId)
+        # the literal match and length only decide between the best counts
+        ranked = []
+        for count in sorted(bycount, reverse=True):
+            ranked.extend((-count, text not in self._texts[objId], len(self._texts[objId]), objId)
+                          for objId in bycount[count])
+            if len(ranked) >= limit:
+                break
+        found = [entry[3] for entry in heapq.nsmallest(limit, ranked)]
+        if len(self._cache) >= CACHESIZE:
+            self._cache.clear()
+        self._cache[(text, limit)] = found
+        return [self._records[objId] for objId in found]
+
+    @staticmethod
+    def _normalize(text):
+        """return text in lowercase, without accents and with only letters, digits and single spaces"""
+        if not isinstance(text, unicode):
+            text = text.decode('utf-8')
+        text = u''.join(character for character in unicodedata.normalize('NFKD', text.lower())
+                        if not unicodedata.combining(character))
+        return u' '.join(re.findall(r'\w+', text, re.UNICODE))
+
+    @staticmethod
+    def _prefixes_of(text):
+        """return the prefixes of up to PREFIXLENGTH characters of the words of a normalized text"""
+        return set(word[:length] for word in text.split() for length in xrange(1, PREFIXLENGTH + 1))
+
+    @staticmethod
+    def _trigrams(text):
+        """yield the trigrams of the words of a normalized text"""
+        for word in text.split():
+            word = u'  ' + word + u' '
+            for start in xrange(len(word) - 2):
+                yield word[start:start + 3]
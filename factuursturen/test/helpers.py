@@ -0,0 +1,14 @@
+class FakeResponse(object):
+    """minimal stand-in for a requests response"""
+    def __init__(self, content='', status_code=200, remaining=100):
+        self.content = content
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = {'x-ratelimit-remaining': str(remaining)}
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
@@ -0,0 +1,53 @@
+from unittest import TestCase
+from datetime import datetime
+import factuursturen
+from factuursturen import analytics
+import json
+from helpers import FakeResponse
+
+
+INVOICES = [{'clientnr': '1', 'open': '100', 'sent': '2013-01-01', 'duedate': '2013-01-31', 'paiddate': ''},
+            {'clientnr': '1', 'open': '50', 'sent': '2013-03-01', 'duedate': '2013-03-31', 'paiddate': ''},
+            {'clientnr': '2', 'open': '25', 'sent': '2013-03-20', 'duedate': '2013-04-19', 'paiddate': ''},
+            {'clientnr': '2', 'open': '0', 'sent': '2013-01-01', 'duedate': '2013-01-31', 'paiddate': '2013-01-11'},
+            {'clientnr': '3', 'open': '0', 'sent': '2013-01-01', 'duedate': '', 'paiddate': '2013-01-21'}]
+
+
+class test_analytics(TestCase):
+    def columns(self, vectorized):
+        fact = factuursturen.Client('foo', 'foo')
+        columns = fact._convert_to_columns(json.loads(json.dumps(INVOICES)), 'invoices')
+        if not vectorized:
+            # the columns as they are without NumPy
+            columns['open'] = [float(invoice['open']) for invoice in INVOICES]
+            for field in ('sent', 'duedate', 'paiddate'):
+                columns[field] = [fact._string2date(invoice[field]) for invoice in INVOICES]
+        return columns
+
+    def test_receivables(self):
+        for vectorized in (True, False):
+            columns = self.columns(vectorized)
+            self.assertDictEqual(analytics.open_per_client(columns), {'1': 150.0, '2': 25.0})
+            self.assertDictEqual(analytics.aging(columns, datetime(2013, 4, 1)),
+                                 {'current': 25.0, '1-30': 50.0, '31-60': 100.0, '61-90': 0.0, '90+': 0.0})
+            self.assertDictEqual(analytics.aging(columns, datetime(2013, 4, 1), bounds=(0, 7)),
+                                 {'current': 25.0, '1-7': 50.0, '7+': 100.0})
+            self.assertDictEqual(analytics.days_to_pay(columns), {'count': 2, 'mean': 15.0, 'median': 15.0,
+                                                                  'per_client': {'2': 10.0, '3': 20.0}})
+
+    def test_receivables_from_api(self):
+        fact = factuursturen.Client('foo', 'foo')
+        fact._session.get = lambda *args, **kwargs: FakeResponse(content=json.dumps(INVOICES))
+        report = analytics.receivables(fact, datetime(2013, 4, 1))
+        self.assertDictEqual(report['open_per_client'], {'1': 150.0, '2': 25.0})
+        self.assertEqual(report['aging']['31-60'], 100.0)
+        self.assertEqual(report['days_to_pay']['count'], 2)
+
+    def test_receivables_missing_fields(self):
+        fact = factuursturen.Client('foo', 'foo')
+        invoices = INVOICES + [{'clientnr': '4', 'sent': '2013-03-01'}]
+        fact._session.get = lambda *args, **kwargs: FakeResponse(content=json.dumps(invoices))
+        report = analytics.receivables(fact, datetime(2013, 4, 1))
+        self.assertDictEqual(report['open_per_client'], {'1': 150.0, '2': 25.0})
+        self.assertEqual(report['aging']['current'], 25.0)
+        self.assertEqual(report['days_to_pay']['count'], 2)
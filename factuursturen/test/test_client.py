@@ -4,6 +4,13 @@ import ConfigParser
 from os.path import expanduser
 from datetime import datetime
 import pytest
+import functools
+import json
+import urlparse
+import os
+import shutil
+import tempfile
+from helpers import FakeResponse
 
 
 class test_client(TestCase):
@@ -94,6 +101,7 @@ class test_client(TestCase):
         test_output = fact._int2string(test_input)
         self.assertEqual(test_output, '123')
         self.assertIsInstance(test_output, str)
+        self.assertEqual(fact._int2string(123L), '123')
         test_input = 123.45
         try:
             test_output = fact._int2string(test_input)
@@ -118,6 +126,7 @@ class test_client(TestCase):
         test_output = fact._float2string(test_input)
         self.assertEqual(test_output, '123.45')
         self.assertIsInstance(test_output, str)
+        self.assertEqual(fact._float2string(123L), '123')
 
 
     def test__date2string(self):
@@ -228,3 +237,458 @@ class test_client(TestCase):
         fact = factuursturen.Client(apikey, username)
         fact._remaining = 1234
         self.assertEqual(fact.remaining, 1234)
+
+    def test__convert_to_columns(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+        test_input = [{'invoicenr': 'F001', 'profile': '1', 'totalintax': '121.00',
+                       'collection': 'false', 'sent': '2013-12-31'},
+                      {'invoicenr': 'F002', 'profile': '2', 'totalintax': '60.50',
+                       'collection': 'true', 'sent': ''}]
+        test_output = fact._convert_to_columns(test_input, 'invoices')
+        self.assertEqual(list(test_output['invoicenr']), ['F001', 'F002'])
+        self.assertEqual(list(test_output['profile']), [1, 2])
+        self.assertEqual(sum(test_output['totalintax']), 181.5)
+        self.assertEqual([bool(value) for value in test_output['collection']], [False, True])
+        if factuursturen.numpy is not None:
+            self.assertEqual(str(test_output['sent'].dtype), 'datetime64[D]')
+            self.assertEqual(str(test_output['sent'][0]), '2013-12-31')
+        else:
+            self.assertEqual(test_output['sent'], [datetime(2013, 12, 31, 0, 0), None])
+        test_input = [{'profile': 'A1'}]
+        try:
+            fact._convert_to_columns(test_input, 'invoices')
+            self.fail("_convert_to_columns should throw exception on unconvertable values")
+        except factuursturen.FactuursturenConversionError:
+            pass
+
+    def test__convert_to_columns_missing_fields(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+        test_input = [{'invoicenr': 'F001', 'profile': '1', 'open': '10.00', 'collection': 'true',
+                       'sent': '2013-12-31'},
+                      {'invoicenr': 'F002'}]
+        numpy = factuursturen.numpy
+        try:
+            for factuursturen.numpy in set([numpy, None]):
+                test_output = fact._convert_to_columns(test_input, 'invoices')
+                self.assertEqual([bool(value) for value in test_output['collection']], [True, False])
+                # missing numbers are NaN, also in an int column
+                self.assertEqual(test_output['open'][0], 10.0)
+                self.assertNotEqual(test_output['open'][1], test_output['open'][1])
+                self.assertEqual(test_output['profile'][0], 1)
+                self.assertNotEqual(test_output['profile'][1], test_output['profile'][1])
+                self.assertEqual(len(test_output['sent']), 2)
+        finally:
+            factuursturen.numpy = numpy
+
+    def test_get_as_columns(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+        fact._session.get = lambda *args, **kwargs: FakeResponse(
+            content=json.dumps([{'id': '1', 'price': '2.50'}, {'id': '2', 'price': '3.00'}]))
+        test_output = fact.get('products', as_columns=True)
+        self.assertEqual(list(test_output['id']), [1, 2])
+        self.assertEqual(sum(test_output['price']), 5.5)
+        try:
+            fact.get('products', 1, as_columns=True)
+            self.fail("get should throw exception when as_columns is used for a single object")
+        except factuursturen.FactuursturenGetError:
+            pass
+
+    def test_get_indexed(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+        fact._session.get = lambda *args, **kwargs: FakeResponse(content=json.dumps(
+            [{'invoicenr': 'F001', 'clientnr': '1', 'open': '10', 'paiddate': ''},
+             {'invoicenr': 'F002', 'clientnr': '2', 'open': '0', 'paiddate': '2013-02-01'},
+             {'invoicenr': 'F003', 'clientnr': '1', 'open': '2.5', 'paiddate': '2013-01-15'}]))
+        invoices = fact.get('invoices', indexed=True)
+        self.assertIsInstance(invoices, factuursturen.IndexedList)
+        self.assertEqual(len(invoices), 3)
+        self.assertListEqual([invoice['invoicenr'] for invoice in invoices.find('clientnr', '1')], ['F001', 'F003'])
+        self.assertEqual(invoices.find_one('invoicenr', 'F002')['clientnr'], '2')
+        self.assertEqual(invoices.find_one('invoicenr', 'F009'), None)
+        self.assertListEqual([invoice['invoicenr'] for invoice in invoices.between('open', 0.1)], ['F003', 'F001'])
+        self.assertListEqual([invoice['invoicenr'] for invoice in
+                              invoices.between('paiddate', datetime(2013, 1, 1), datetime(2013, 1, 31))], ['F003'])
+        # changing the list drops the indexes
+        invoices.append({'invoicenr': 'F004', 'clientnr': '1', 'open': 5.0, 'paiddate': None})
+        self.assertEqual(len(invoices.find('clientnr', '1')), 3)
+        self.assertListEqual([invoice['invoicenr'] for invoice in invoices.between('open', 3, 10)], ['F004', 'F001'])
+        try:
+            fact.get('invoices', 'F001', indexed=True)
+            self.fail("get should throw exception when indexed is used for a single object")
+        except factuursturen.FactuursturenGetError:
+            pass
+
+    def test__iter_json_list(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+        document = ' [ {"id": "1", "name": "a,]"}, {"id": "2", "name": "b"} ,12 ] '
+        chunks = [document[start:start + 3] for start in range(0, len(document), 3)]
+        test_output = list(fact._iter_json_list(chunks))
+        self.assertListEqual(test_output, [{'id': '1', 'name': 'a,]'}, {'id': '2', 'name': 'b'}, 12])
+        try:
+            list(fact._iter_json_list(['[{"id": "1"}, {"id"']))
+            self.fail("_iter_json_list should throw exception on an incomplete list")
+        except factuursturen.FactuursturenGetError:
+            pass
+        try:
+            list(fact._iter_json_list(['{"id": "1"}']))
+            self.fail("_iter_json_list should throw exception when the document is not a list")
+        except factuursturen.FactuursturenGetError:
+            pass
+
+    def test_iter_get(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+        fact._session.get = lambda *args, **kwargs: FakeResponse(
+            content='[{"id": "1", "price": "2.50"}, {"id": "2", "price": "3.00"}]', remaining=42)
+        test_output = list(fact.iter_get('products', chunk_size=7))
+        self.assertListEqual(test_output, [{'id': 1, 'price': 2.5}, {'id': 2, 'price': 3.0}])
+        self.assertEqual(fact.remaining, 42)
+        fact._session.get = lambda *args, **kwargs: FakeResponse(status_code=404)
+        try:
+            list(fact.iter_get('products'))
+            self.fail("iter_get should throw exception when the server returns 404")
+        except factuursturen.FactuursturenNotFound:
+            pass
+
+    def test__load_json_backend(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username, json_backend='json')
+        self.assertEqual(fact.json_backend, 'json')
+        self.assertEqual(fact._json_loads('{"id": "1"}'), {'id': '1'})
+        self.assertEqual(json.loads(fact._json_dumps({'id': '1'})), {'id': '1'})
+        fact = factuursturen.Client(apikey, username)
+        self.assertIn(fact.json_backend, factuursturen.JSONBACKENDS)
+        try:
+            factuursturen.Client(apikey, username, json_backend='nosuchlibrary')
+            self.fail("Client should throw exception on an unknown JSON backend")
+        except factuursturen.FactuursturenWrongCall:
+            pass
+
+    def test_send_does_not_change_data(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+        test_input = {'clientnr': 123,
+                      'contact': 'John Doe',
+                      'showcontact': True,
+                      'reference': {'line1': 'remark1'}}
+        expected_output = {'clientnr': '123',
+                           'contact': 'John Doe',
+                           'showcontact': 'true',
+                           'reference[line1]': 'remark1'}
+        sent = []
+        fact._session.post = lambda url, data, **kwargs: sent.append(data) or FakeResponse(content='1')
+        fact._session.put = lambda url, data, **kwargs: sent.append(data) or FakeResponse()
+        fact.post('clients', test_input)
+        fact.put('clients', 123, test_input)
+        self.assertListEqual([dict(urlparse.parse_qsl(body)) for body in sent], [expected_output, expected_output])
+        self.assertDictEqual(test_input, {'clientnr': 123,
+                                          'contact': 'John Doe',
+                                          'showcontact': True,
+                                          'reference': {'line1': 'remark1'}})
+
+    def test__serialize(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+        test_input = {'clientnr': 123,
+                      'collection': True,
+                      'reference': {'line1': 'remark1',
+                                    'line2': 'remark2'},
+                      'lines': {'line0': {'amount_desc': 1, 'tax': 21},
+                                'line1': {'amount_desc': 2, 'tax': 21}}}
+        expected_output = {'clientnr': 123,
+                           'collection': 'true',
+                           'reference[line1]': 'remark1',
+                           'reference[line2]': 'remark2',
+                           'lines[0][amount_desc]': 1,
+                           'lines[0][tax]': 21,
+                           'lines[1][amount_desc]': 2,
+                           'lines[1][tax]': 21}
+        test_output = dict(fact._serialize(test_input, 'invoices'))
+        self.assertDictEqual(test_output, expected_output)
+        self.assertDictEqual(test_output, fact._fixkeynames(fact._flatten(
+            fact._convertstringfields_in_dict(dict(test_input), 'invoices', 'tostring'))))
+
+    def test__encode_for_send(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+        test_input = {'clientnr': 123,
+                      'company': u'Caf\xe9',
+                      'notes': None,
+                      'reference': {'line1': 'a&b'}}
+        test_output = fact._encode_for_send(test_input, 'clients')
+        self.assertDictEqual(dict(urlparse.parse_qsl(test_output)), {'clientnr': '123',
+                                                                     'company': 'Caf\xc3\xa9',
+                                                                     'reference[line1]': 'a&b'})
+
+    def test__intern(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username, intern_strings=True)
+        test_input = [{'clientnr': '1', 'city': u''.join([u'Amster', u'dam'])},
+                      {'clientnr': '2', 'city': u''.join([u'Amster', u'dam'])}]
+        self.assertIsNot(test_input[0]['city'], test_input[1]['city'])
+        test_output = fact._convertstringfields_in_list_of_dicts(test_input, 'clients', 'fromstring')
+        self.assertEqual(test_output[0]['city'], u'Amsterdam')
+        self.assertIs(test_output[0]['city'], test_output[1]['city'])
+        self.assertEqual(fact._intern(None), None)
+        fact = factuursturen.Client(apikey, username)
+        test_input = [{'city': u''.join([u'Amster', u'dam'])},
+                      {'city': u''.join([u'Amster', u'dam'])}]
+        test_output = fact._convertstringfields_in_list_of_dicts(test_input, 'clients', 'fromstring')
+        self.assertIsNot(test_output[0]['city'], test_output[1]['city'])
+
+    def test__validator(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+        validate = fact._validator('products')
+        self.assertListEqual(validate({'code': 'P1', 'name': 'Product', 'price': 12, 'taxes': 21}), [])
+        self.assertListEqual(validate({'code': 'P1', 'name': 'Product', 'price': '12', 'taxes': 21}),
+                             ['field price should be of type float'])
+        self.assertListEqual(validate({'code': 'P1', 'price': 12.5, 'taxes': 21}), ['missing field name'])
+        self.assertIs(fact._validator('products'), validate)
+        # what passes validation can be converted
+        product = {'code': 'P1', 'name': 'Product', 'price': 12L, 'taxes': 21L}
+        self.assertListEqual(validate(product), [])
+        self.assertDictEqual(dict(fact._serialize(product, 'products')),
+                             {'code': 'P1', 'name': 'Product', 'price': '12', 'taxes': '21'})
+        validate = fact._validator('invoices')
+        line = {'amount': 1, 'description': 'Product', 'tax_rate': 21, 'price': 12.5}
+        self.assertListEqual(validate({'clientnr': 1, 'action': 'send', 'lines': {'line0': line}}), [])
+        self.assertListEqual(validate({'clientnr': 1, 'action': 'send', 'lines': []}),
+                             ['field lines should be a non-empty dict of lines'])
+        self.assertListEqual(validate({'clientnr': 1, 'action': 'send',
+                                       'lines': {'line0': {'amount': 1, 'description': 'Product',
+                                                           'tax_rate': 21.5, 'price': 12.5}}}),
+                             ['field tax_rate in line line0 should be of type int'])
+
+    def test_post_invalid_data(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+        fact._session.post = lambda *args, **kwargs: self.fail("invalid data should not be posted")
+        try:
+            fact.post('products', {'code': 'P1', 'name': 'Product', 'price': 'cheap', 'taxes': 21})
+            self.fail("post should throw exception on invalid data")
+        except factuursturen.FactuursturenWrongPostvalue:
+            pass
+
+    def test_post_many(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+
+        def fake_post(url, data, **kwargs):
+            fields = dict(urlparse.parse_qsl(data))
+            if fields['code'] == 'P3':
+                return FakeResponse(content='duplicate code', status_code=400)
+            return FakeResponse(content=fields['code'][1:], remaining=1000)
+
+        fact._session.post = fake_post
+        items = [{'code': 'P{}'.format(number), 'name': 'Product', 'price': 1.5, 'taxes': 21}
+                 for number in range(1, 21)]
+        items[1] = {'code': 'P2', 'name': 'Product', 'price': 'cheap', 'taxes': 21}
+        test_output = fact.post_many('products', items, concurrency=4)
+        self.assertEqual(len(test_output), 20)
+        self.assertEqual(test_output[0], '1')
+        self.assertIsInstance(test_output[1], factuursturen.FactuursturenWrongPostvalue)
+        self.assertIsInstance(test_output[2], factuursturen.FactuursturenWrongPostvalue)
+        self.assertListEqual(test_output[3:], [str(number) for number in range(4, 21)])
+
+    def test_post_many_remaining(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+        fact._remaining = 2
+        fact._session.post = lambda *args, **kwargs: FakeResponse(content='1', remaining=fact._remaining - 1)
+        items = [{'code': 'P1', 'name': 'Product', 'price': 1.5, 'taxes': 21}] * 4
+        test_output = fact.post_many('products', items, concurrency=1)
+        self.assertListEqual(test_output[:2], ['1', '1'])
+        self.assertIsInstance(test_output[2], factuursturen.FactuursturenNoMoreApiCalls)
+        self.assertIsInstance(test_output[3], factuursturen.FactuursturenNoMoreApiCalls)
+
+    def test_put_many(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+        urls = []
+        fact._session.put = lambda url, data, **kwargs: urls.append(url) or FakeResponse()
+        items = [(number, {'code': 'P{}'.format(number), 'name': 'Product', 'price': 1.5, 'taxes': 21})
+                 for number in range(1, 11)]
+        items.append((11, {'code': 'P11'}))
+        test_output = fact.put_many('products', items, concurrency=3)
+        self.assertListEqual(test_output[:10], [None] * 10)
+        self.assertIsInstance(test_output[10], factuursturen.FactuursturenWrongPutvalue)
+        self.assertEqual(len(urls), 10)
+        self.assertEqual(fact.bulkstats['calls'], 10)
+        self.assertEqual(fact.bulkstats['errors'], 0)
+        try:
+            fact.put_many('invoices', items)
+            self.fail("put_many should throw exception for functions that cannot be put")
+        except factuursturen.FactuursturenPostError:
+            pass
+
+    def test_put_many_unexpected_error(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+        urls = []
+
+        def fake_put(url, data, **kwargs):
+            urls.append(url)
+            if url.endswith('/2'):
+                raise ValueError('unexpected')
+            return FakeResponse()
+
+        fact._session.put = fake_put
+        items = [(number, {'code': 'P{}'.format(number), 'name': 'Product', 'price': 1.5, 'taxes': 21})
+                 for number in range(1, 5)]
+        test_output = fact.put_many('products', items, concurrency=1)
+        self.assertEqual(len(urls), 4)
+        self.assertListEqual([test_output[0], test_output[2], test_output[3]], [None] * 3)
+        self.assertIsInstance(test_output[1], factuursturen.FactuursturenError)
+        self.assertEqual(fact.bulkstats['errors'], 1)
+
+    def test_run_many(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+
+        def job(number):
+            if number == 3:
+                raise IOError('disk full')
+            return number * 2
+
+        jobs = ((number, functools.partial(job, number)) for number in range(6))
+        test_output = dict(fact.run_many(jobs, concurrency=2, readahead=1))
+        self.assertListEqual([test_output[number] for number in (0, 1, 2, 4, 5)], [0, 2, 4, 8, 10])
+        self.assertIsInstance(test_output[3], factuursturen.FactuursturenError)
+        self.assertEqual(fact.bulkstats['calls'], 6)
+        self.assertEqual(fact.bulkstats['errors'], 1)
+        # no calls left
+        fact._remaining = 0
+        test_output = dict(fact.run_many([(number, functools.partial(job, number)) for number in range(3)],
+                                         concurrency=1))
+        self.assertIsInstance(test_output[0], factuursturen.FactuursturenNoMoreApiCalls)
+        # stopping early stops taking jobs
+        started = []
+        outcomes = fact.run_many(((number, functools.partial(started.append, number)) for number in range(100)),
+                                 concurrency=1, readahead=1)
+        fact._remaining = None
+        next(outcomes)
+        outcomes.close()
+        self.assertLess(len(started), 10)
+
+    def test_send_many(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+        fact._session.post = lambda url, data, **kwargs: FakeResponse(content='42')
+        urls = []
+        fact._session.put = lambda url, data, **kwargs: urls.append(url) or FakeResponse()
+        items = iter([(None, {'code': 'P1', 'name': 'Product', 'price': 1.5, 'taxes': 21}),
+                      (7, {'code': 'P2', 'name': 'Product', 'price': 1.5, 'taxes': 21}),
+                      (None, {'code': 'P3'})])
+        test_output = dict(fact.send_many('products', items, concurrency=2))
+        self.assertEqual(test_output[0], '42')
+        self.assertEqual(test_output[1], None)
+        self.assertIsInstance(test_output[2], factuursturen.FactuursturenWrongPostvalue)
+        self.assertEqual(len(urls), 1)
+        self.assertRaises(factuursturen.FactuursturenPostError, fact.send_many, 'invoices', [])
+
+    def test_convert_fields(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+        record = {'price': '1.50', 'taxes': 21, 'name': 'Product'}
+        self.assertDictEqual(fact.convert_fields('products', record), {'price': 1.5, 'taxes': 21, 'name': 'Product'})
+        self.assertEqual(record['price'], '1.50')
+
+    def test_delete_many(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+
+        def fake_delete(url, **kwargs):
+            if url.endswith('/F%2F002'):
+                return FakeResponse(content='not found', status_code=404)
+            return FakeResponse()
+
+        fact._session.delete = fake_delete
+        test_output = fact.delete_many('invoices_saved', ['F001', 'F/002', 'F003'], concurrency=2)
+        self.assertEqual(test_output[0], None)
+        self.assertIsInstance(test_output[1], factuursturen.FactuursturenError)
+        self.assertEqual(test_output[2], None)
+        self.assertEqual(fact.bulkstats['calls'], 3)
+        self.assertEqual(fact.bulkstats['errors'], 1)
+
+    def test_sync_unsendable_values(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+        calls = []
+        remote = [{'id': '1', 'code': 'P1', 'name': u'Caf\xe9', 'price': '1.50', 'taxes': '21'},
+                  {'id': '2', 'code': 'P2', 'name': 'Two', 'taxes': '21'}]
+        fact._session.get = lambda url, **kwargs: calls.append(('get', url)) or FakeResponse(content=json.dumps(remote))
+        fact._session.put = lambda url, data, **kwargs: calls.append(('put', url)) or FakeResponse()
+        # a UTF-8 byte string matches the same text from the API
+        desired = [{'code': 'P1', 'name': 'Caf\xc3\xa9', 'price': 1.5, 'taxes': 21},
+                   {'code': 'P2', 'name': 'Two', 'price': 2.5, 'taxes': 21}]
+        report = fact.sync('products', desired, 'code')
+        self.assertEqual((report['updated'], report['unchanged']), (1, 1))
+        # the remote product without a price counts as changed
+        self.assertIn(('put', fact._url + 'products/2'), calls)
+
+    def test_sync(self):
+        apikey = 'foo'
+        username = 'foo'
+        fact = factuursturen.Client(apikey, username)
+        calls = []
+        remote = [{'id': '1', 'code': 'P1', 'name': 'One', 'price': '1.50', 'taxes': '21'},
+                  {'id': '2', 'code': 'P2', 'name': 'Two', 'price': '2.50', 'taxes': '21'},
+                  {'id': '3', 'code': 'P3', 'name': 'Three', 'price': '3.50', 'taxes': '21'}]
+        fact._session.get = lambda url, **kwargs: calls.append(('get', url)) or FakeResponse(content=json.dumps(remote))
+        fact._session.post = lambda url, data, **kwargs: calls.append(('post', url)) or FakeResponse(content='4')
+        fact._session.put = lambda url, data, **kwargs: calls.append(('put', url)) or FakeResponse()
+        fact._session.delete = lambda url, **kwargs: calls.append(('delete', url)) or FakeResponse()
+        desired = [{'code': 'P1', 'name': 'One', 'price': 1.5, 'taxes': 21},
+                   {'code': 'P2', 'name': 'Two', 'price': 2.75, 'taxes': 21},
+                   {'code': 'P4', 'name': 'Four', 'price': 4.5, 'taxes': 21}]
+        directory = tempfile.mkdtemp()
+        try:
+            cachefile = os.path.join(directory, 'products.cache')
+            report = fact.sync('products', desired, 'code', delete=True, cachefile=cachefile)
+            self.assertEqual((report['created'], report['updated'], report['deleted'], report['unchanged']),
+                             (1, 1, 1, 1))
+            self.assertEqual(report['calls'], 4)
+            self.assertEqual(sorted(verb for verb, url in calls), ['delete', 'get', 'post', 'put'])
+            self.assertIn(('put', fact._url + 'products/2'), calls)
+            self.assertIn(('delete', fact._url + 'products/3'), calls)
+
+            del calls[:]
+            report = fact.sync('products', desired, 'code', delete=True, cachefile=cachefile)
+            self.assertListEqual(calls, [])
+            self.assertEqual(report['unchanged'], 3)
+            self.assertEqual(report['calls_saved'], 3)
+
+            desired[0] = {'code': 'P1', 'name': 'One', 'price': 1.75, 'taxes': 21}
+            report = fact.sync('products', desired, 'code', cachefile=cachefile)
+            self.assertListEqual(calls, [('put', fact._url + 'products/1')])
+            self.assertEqual(report['calls_saved'], 2)
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,147 @@
+from unittest import TestCase
+from datetime import datetime
+import factuursturen
+from factuursturen import download
+import logging
+import os
+import shutil
+import tempfile
+
+
+class test_download(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.logger = logging.getLogger('test_download')
+        self.logger.addHandler(logging.NullHandler())
+        self.invoice = {u'invoicenr': u'F001', u'sent': datetime(2013, 1, 1), u'paiddate': None,
+                        u'lastreminder': None}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_plan_windows(self):
+        self.assertListEqual(download.plan_windows(5, 10, 100), [5])
+        self.assertListEqual(download.plan_windows(250, 30, 100), [30, 100, 100, 20])
+        self.assertListEqual(download.plan_windows(3, 0, 2), [0, 2, 1])
+
+    def test_shards(self):
+        self.assertEqual(download.parse_shard('2/4'), (2, 4))
+        self.assertRaises(ValueError, download.parse_shard, '0/4')
+        self.assertRaises(ValueError, download.parse_shard, '5/4')
+        self.assertRaises(ValueError, download.parse_shard, 'two')
+        invoices = [{u'invoicenr': u'F{:03d}'.format(number), u'sent': datetime(2010 + number % 4, 1, 1)}
+                    for number in range(50)]
+        for shard_by in ('hash', 'year'):
+            owners = [[shard for shard in range(1, 4) if download.in_shard(invoice, (shard, 3), shard_by)]
+                      for invoice in invoices]
+            # every invoice belongs to exactly one shard
+            self.assertTrue(all(len(owner) == 1 for owner in owners))
+        self.assertTrue(download.in_shard(invoices[0], None, 'hash'))
+
+    def test_next_poll(self):
+        self.assertEqual(download.next_poll(100, 0, None, 60, 3600, 300), 200)
+        self.assertEqual(download.next_poll(100, 3, None, 60, 3600, 300), 60)
+        self.assertEqual(download.next_poll(3000, 0, None, 60, 3600, 300), 3600)
+        # polling takes at most half of the remaining calls
+        self.assertEqual(download.next_poll(100, 3, 10, 60, 3600, 300), 720)
+        self.assertEqual(download.next_poll(100, 3, 0, 60, 3600, 300), 300)
+
+    def test_manifest(self):
+        filename = os.path.join(self.directory, '2013', 'F001.pdf')
+        manifest = download.Manifest(os.path.join(self.directory, 'manifest.sqlite'))
+        writer = download.BatchedWriter(2)
+        self.assertFalse(manifest.is_current(self.invoice, filename, writer))
+        writer.write(filename, '%PDF-1', lambda: manifest.record(self.invoice, filename, 6, 'checksum'))
+        # renamed and recorded once the batch is synced
+        self.assertFalse(os.path.exists(filename))
+        self.assertFalse(manifest.is_current(self.invoice, filename, writer))
+        writer.flush()
+        self.assertTrue(manifest.is_current(self.invoice, filename, writer))
+        self.assertFalse(os.path.exists(filename + '.part'))
+        # a paid invoice is downloaded again
+        paid = dict(self.invoice, paiddate=datetime(2013, 2, 1))
+        self.assertFalse(manifest.is_current(paid, filename, writer))
+        # and so is one whose file was removed
+        os.remove(filename)
+        self.assertFalse(manifest.is_current(self.invoice, filename, writer))
+        manifest.close()
+
+    def test_readonly_manifest(self):
+        filename = os.path.join(self.directory, 'manifest.sqlite')
+        writer = download.BatchedWriter(0)
+        manifest = download.Manifest(filename, readonly=True)
+        self.assertFalse(manifest.is_current(self.invoice, filename, writer))
+        manifest.close()
+        self.assertListEqual(os.listdir(self.directory), [])
+        # an existing manifest is read
+        pdf = os.path.join(self.directory, 'F001.pdf')
+        open(pdf, 'w').close()
+        manifest = download.Manifest(filename)
+        manifest.record(self.invoice, pdf, 0, 'checksum')
+        manifest.close()
+        manifest = download.Manifest(filename, readonly=True)
+        self.assertTrue(manifest.is_current(self.invoice, pdf, writer))
+        manifest.close()
+
+    def test_archive_writer(self):
+        for kind in ('zip', 'tar'):
+            recorded = []
+            path = os.path.join(self.directory, '2013.{}'.format(kind))
+            writer = download.ArchiveWriter(kind, 2)
+            for name in ('F001.pdf', 'F002.pdf', 'F003.pdf'):
+                writer.write(os.path.join(path, name), '%PDF-' + name, lambda name=name: recorded.append(name))
+            # recorded once the archive is in place
+            self.assertListEqual(recorded, [])
+            writer.flush()
+            self.assertListEqual(recorded, ['F001.pdf', 'F002.pdf', 'F003.pdf'])
+            # a new writer finds the members of the existing archive
+            writer = download.ArchiveWriter(kind, 2)
+            self.assertTrue(writer.contains(os.path.join(path, 'F002.pdf'), 13))
+            self.assertFalse(writer.contains(os.path.join(path, 'F002.pdf'), 12))
+            self.assertFalse(writer.contains(os.path.join(path, 'F004.pdf'), 13))
+            # a run that is never flushed leaves the archive as it was
+            writer.write(os.path.join(path, 'F004.pdf'), '%PDF-F004.pdf', lambda: None)
+            writer = download.ArchiveWriter(kind, 2)
+            self.assertTrue(writer.contains(os.path.join(path, 'F003.pdf'), 13))
+            self.assertFalse(writer.contains(os.path.join(path, 'F004.pdf'), 13))
+            writer.write(os.path.join(path, 'F004.pdf'), '%PDF-F004.pdf', lambda: None)
+            writer.flush()
+            self.assertTrue(download.ArchiveWriter(kind, 2).contains(os.path.join(path, 'F004.pdf'), 13))
+
+    def test_damaged_archive(self):
+        path = os.path.join(self.directory, '2013.zip')
+        with open(path, 'wb') as f:
+            f.write('PK\x03\x04 truncated')
+        # a dry run leaves it alone
+        writer = download.ArchiveWriter('zip', 2, readonly=True)
+        self.assertFalse(writer.contains(os.path.join(path, 'F001.pdf'), 13))
+        self.assertListEqual(os.listdir(self.directory), ['2013.zip'])
+        writer = download.ArchiveWriter('zip', 2)
+        self.assertFalse(writer.contains(os.path.join(path, 'F001.pdf'), 13))
+        self.assertTrue(os.path.exists(path + '.damaged'))
+        writer.write(os.path.join(path, 'F001.pdf'), '%PDF-F001.pdf', lambda: None)
+        writer.flush()
+        self.assertTrue(download.ArchiveWriter('zip', 2).contains(os.path.join(path, 'F001.pdf'), 13))
+
+    def test_download_all(self):
+        fact = factuursturen.Client('foo', 'foo')
+        progress = download.Progress(fact)
+        writer = download.BatchedWriter(0)
+        calls = []
+
+        def job(invoicenr):
+            calls.append(invoicenr)
+            if invoicenr == 'F2' and calls.count('F2') == 1:
+                raise factuursturen.FactuursturenNoMoreApiCalls('limit of API calls reached.')
+            if invoicenr == 'F3':
+                raise IOError(28, 'No space left on device')
+
+        jobs = [(invoicenr, lambda invoicenr=invoicenr: job(invoicenr)) for invoicenr in ('F1', 'F2', 'F3', 'F4')]
+        # F2 waits for new calls once, F3 fails, the others are downloaded
+        self.assertEqual(download.download_all(fact, jobs, writer, progress, self.logger, workers=1, wait=0.01), 1)
+        self.assertListEqual(sorted(calls), ['F1', 'F2', 'F2', 'F3', 'F4'])
+        # without waiting, the invoices left count as not downloaded
+        calls[:] = []
+        self.assertEqual(download.download_all(fact, jobs[1:2], writer, progress, self.logger, workers=1, wait=0), 1)
+        fact._remaining = 0
+        self.assertEqual(download.download_all(fact, jobs, writer, progress, self.logger, workers=2, wait=0), 4)
@@ -0,0 +1,54 @@
+from unittest import TestCase
+import factuursturen
+import argparse
+import imp
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from helpers import FakeResponse
+
+importrecords = imp.load_source('importrecords', os.path.join(os.path.dirname(__file__), '..', '..', 'bin',
+                                                              'importrecords.py'))
+
+
+class test_importrecords(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'products.csv')
+        self.logger = logging.getLogger('test_importrecords')
+        self.logger.addHandler(logging.NullHandler())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def arguments(self, **kwargs):
+        arguments = dict(file=self.filename, type='products', format=None, map=None, id_column='id', workers=4,
+                         queue=None, journal=None)
+        arguments.update(kwargs)
+        return argparse.Namespace(**arguments)
+
+    def test_import_rows(self):
+        with open(self.filename, 'wb') as f:
+            f.write('id,code,name,price,taxes\n')
+            for number in range(200):
+                # every tenth row updates an existing product, row 51 has an invalid price
+                f.write('{},P{},Product {},{},21\n'.format(number if number % 10 == 0 else '', number, number,
+                                                          'abc' if number == 50 else '1.50'))
+        fact = factuursturen.Client('foo', 'foo')
+        lock = threading.Lock()
+        sent = []
+
+        def fake_send(url, data, **kwargs):
+            with lock:
+                sent.append(url)
+            if 'P99&' in data or data.endswith('P99'):
+                return FakeResponse(content='code exists', status_code=400)
+            return FakeResponse(content='1')
+
+        fact._session.post = fake_send
+        fact._session.put = fake_send
+        counts = importrecords.import_rows(fact, self.arguments(), self.logger)
+        self.assertDictEqual(counts, {'created': 179, 'updated': 19, 'failed': 2, 'skipped': 0})
+        self.assertEqual(len(sent), 199)
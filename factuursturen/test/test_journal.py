@@ -0,0 +1,164 @@
+from unittest import TestCase
+import factuursturen
+import os
+import shutil
+import sqlite3
+import tempfile
+import urlparse
+from helpers import FakeResponse
+
+
+class test_journal(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'journal.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_key(self):
+        key = factuursturen.Journal.key('post', 'products', None, 'code=P1&name=Product', 0)
+        self.assertEqual(key, factuursturen.Journal.key('post', 'products', None, 'name=Product&code=P1', 0))
+        self.assertNotEqual(key, factuursturen.Journal.key('post', 'products', None, 'code=P1&name=Product', 1))
+        self.assertNotEqual(key, factuursturen.Journal.key('post', 'clients', None, 'code=P1&name=Product', 0))
+
+    def test_begin_finish(self):
+        journal = factuursturen.Journal(self.filename)
+        self.assertEqual(journal.lookup('a'), None)
+        journal.begin('a', 'put', 'products', 12)
+        self.assertEqual(journal.lookup('a'), ('pending', None))
+        self.assertListEqual(journal.pending(), [('a', 'put', 'products', '12')])
+        journal.finish('a', 'done', None)
+        journal.close()
+        journal = factuursturen.Journal(self.filename)
+        self.assertEqual(journal.lookup('a'), ('done', None))
+        journal.forget('a')
+        self.assertEqual(journal.lookup('a'), None)
+        journal.close()
+
+    def test_post_many_resume(self):
+        fact = factuursturen.Client('foo', 'foo')
+        posted = []
+
+        def fake_post(url, data, **kwargs):
+            code = dict(urlparse.parse_qsl(data))['code']
+            posted.append(code)
+            if code == 'P3' and posted.count('P3') == 1:
+                return FakeResponse(content='temporary failure', status_code=500)
+            return FakeResponse(content=code[1:])
+
+        fact._session.post = fake_post
+        items = [{'code': 'P{}'.format(number), 'name': 'Product', 'price': 1.5, 'taxes': 21}
+                 for number in range(1, 6)]
+        journal = factuursturen.Journal(self.filename)
+        test_output = fact.post_many('products', items, concurrency=2, journal=journal)
+        self.assertIsInstance(test_output[2], factuursturen.FactuursturenWrongPostvalue)
+        self.assertEqual(len(posted), 5)
+
+        test_output = fact.post_many('products', items, concurrency=2, journal=journal)
+        self.assertListEqual(test_output, ['1', '2', '3', '4', '5'])
+        self.assertEqual(len(posted), 6)
+        journal.close()
+
+    def test_post_many_interrupted(self):
+        fact = factuursturen.Client('foo', 'foo')
+        fact._session.post = lambda *args, **kwargs: self.fail("interrupted posts should not be sent again")
+        item = {'code': 'P1', 'name': 'Product', 'price': 1.5, 'taxes': 21}
+        body, headers = fact._prepare_body(item, 'products', factuursturen.FactuursturenWrongPostvalue)
+        journal = factuursturen.Journal(self.filename)
+        journal.begin(factuursturen.Journal.key('post', 'products', None, body, 0), 'post', 'products', None)
+        test_output = fact.post_many('products', [item], journal=journal)
+        self.assertIsInstance(test_output[0], factuursturen.FactuursturenPostError)
+        journal.close()
+
+    def test_send_many_inserted_item(self):
+        fact = factuursturen.Client('foo', 'foo')
+        posted = []
+
+        def fake_post(url, data, **kwargs):
+            code = dict(urlparse.parse_qsl(data))['code']
+            posted.append(code)
+            return FakeResponse(content=code[1:])
+
+        fact._session.post = fake_post
+        items = [(None, {'code': 'P{}'.format(number), 'name': 'Product', 'price': 1.5, 'taxes': 21})
+                 for number in range(1, 4)]
+        journal = factuursturen.Journal(self.filename)
+        items.append((None, {'code': 'P9', 'name': 'Product'}))
+        list(fact.send_many('products', iter(items), journal=journal))
+        self.assertEqual(len(posted), 3)
+        # the keys do not depend on the position of an item in the file
+        items.insert(0, (None, {'code': 'P0', 'name': 'Product', 'price': 1.5, 'taxes': 21}))
+        test_output = dict(fact.send_many('products', iter(items), journal=journal))
+        # the workers post concurrently, so the first three may come in any order
+        self.assertListEqual(sorted(posted[:3]) + posted[3:], ['P1', 'P2', 'P3', 'P0'])
+        self.assertListEqual([test_output[position] for position in range(4)], ['0', '1', '2', '3'])
+        self.assertEqual(fact.bulkstats['skipped'], 3)
+        journal.close()
+
+    def test_journal_cleared_after_success(self):
+        fact = factuursturen.Client('foo', 'foo')
+        put = []
+        fact._session.put = lambda url, data, **kwargs: put.append(data) or FakeResponse()
+        journal = factuursturen.Journal(self.filename)
+        first = {'code': 'P1', 'name': 'Product', 'price': 1.5, 'taxes': 21}
+        second = dict(first, price=2.5)
+        for item in (first, second, first):
+            self.assertListEqual(fact.put_many('products', [(1, item)], journal=journal), [None])
+        # setting the price back is sent as well
+        self.assertEqual(len(put), 3)
+        self.assertListEqual(journal.pending(), [])
+        journal.close()
+
+    def test_send_many_resume_bounded(self):
+        fact = factuursturen.Client('foo', 'foo')
+        posted = []
+
+        def fake_post(url, data, **kwargs):
+            code = dict(urlparse.parse_qsl(data))['code']
+            posted.append(code)
+            if code == 'P199' and posted.count('P199') == 1:
+                return FakeResponse(content='temporary failure', status_code=500)
+            return FakeResponse(content=code[1:])
+
+        fact._session.post = fake_post
+        items = [(None, {'code': 'P{}'.format(number), 'name': 'Product', 'price': 1.5, 'taxes': 21})
+                 for number in range(200)]
+        journal = factuursturen.Journal(self.filename)
+        journal.begin('other', 'put', 'products', 12, 'another run')
+        list(fact.send_many('products', iter(items), concurrency=2, journal=journal, readahead=4))
+        self.assertEqual(len(posted), 200)
+
+        read = []
+
+        def rows():
+            for item in items:
+                read.append(item)
+                yield item
+
+        outcomes = fact.send_many('products', rows(), concurrency=2, journal=journal, readahead=4)
+        next(outcomes)
+        # the items done before are answered through the queues, not read ahead all at once
+        self.assertLess(len(read), 20)
+        self.assertEqual(len(list(outcomes)), 199)
+        self.assertEqual(len(posted), 201)
+        self.assertEqual(fact.bulkstats['skipped'], 199)
+        self.assertEqual(fact.bulkstats['calls'], 1)
+        # the entries of this run are removed, also the ones done in the first run
+        self.assertListEqual(journal.pending(), [('other', 'put', 'products', '12')])
+        self.assertEqual(journal._connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0], 1)
+        journal.close()
+
+    def test_journal_without_runs(self):
+        connection = sqlite3.connect(self.filename)
+        connection.execute('CREATE TABLE entries (key TEXT PRIMARY KEY, verb TEXT, function TEXT, objid TEXT,'
+                           ' state TEXT, result TEXT, updated REAL)')
+        connection.execute("INSERT INTO entries VALUES ('a', 'put', 'products', '12', 'done', NULL, 0)")
+        connection.commit()
+        connection.close()
+        journal = factuursturen.Journal(self.filename)
+        self.assertEqual(journal.lookup('a'), ('done', None))
+        journal.claim('a', 'run')
+        journal.forget_run('run')
+        self.assertEqual(journal.lookup('a'), None)
+        journal.close()
@@ -0,0 +1,79 @@
+from unittest import TestCase
+from datetime import datetime
+import factuursturen
+import json
+import os
+import shutil
+import tempfile
+from helpers import FakeResponse
+
+
+class test_mirror(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'mirror.db')
+        self.invoices = [{'invoicenr': 'F001', 'clientnr': '1', 'sent': '2013-01-01', 'open': '10.5',
+                          'collection': 'false', 'paiddate': '', 'lines': [{'amount': '1'}]},
+                         {'invoicenr': 'F002', 'clientnr': '2', 'sent': '2013-02-01', 'open': '0',
+                          'collection': 'true', 'paiddate': '2013-02-10', 'lines': []}]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def refresh(self, mirror):
+        fact = factuursturen.Client('foo', 'foo')
+        fact._session.get = lambda url, **kwargs: FakeResponse(content=json.dumps(self.invoices))
+        return mirror.refresh(fact, ['invoices'])['invoices']
+
+    def test_refresh(self):
+        mirror = factuursturen.Mirror(self.filename)
+        self.assertEqual(mirror.refreshed('invoices'), None)
+        self.assertDictEqual(self.refresh(mirror), {'inserted': 2, 'updated': 0, 'deleted': 0, 'unchanged': 0})
+        self.assertNotEqual(mirror.refreshed('invoices'), None)
+
+        invoice = mirror.find('invoices', invoicenr='F001')[0]
+        self.assertEqual(invoice['open'], 10.5)
+        self.assertEqual(invoice['sent'], datetime(2013, 1, 1))
+        self.assertEqual(invoice['paiddate'], None)
+        self.assertIs(invoice['collection'], False)
+        self.assertListEqual(invoice['lines'], [{'amount': '1'}])
+        self.assertListEqual([row['invoicenr'] for row in mirror.query(
+            'SELECT invoicenr FROM invoices WHERE open > ? ORDER BY sent', (0,))], ['F001'])
+
+        # only the differences are written
+        self.invoices[0]['open'] = '0'
+        self.invoices[0]['paiddate'] = '2013-03-01'
+        del self.invoices[1]
+        self.invoices.append({'invoicenr': 'F003', 'clientnr': '1', 'sent': '2013-03-01', 'open': '5',
+                              'remark': 'new field'})
+        self.assertDictEqual(self.refresh(mirror), {'inserted': 1, 'updated': 1, 'deleted': 1, 'unchanged': 0})
+        mirror.close()
+
+        mirror = factuursturen.Mirror(self.filename)
+        self.assertDictEqual(self.refresh(mirror), {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 2})
+        self.assertListEqual([invoice['invoicenr'] for invoice in mirror.find('invoices', order_by='sent')],
+                             ['F001', 'F003'])
+        self.assertEqual(mirror.find('invoices', paiddate=datetime(2013, 3, 1))[0]['invoicenr'], 'F001')
+        self.assertEqual(mirror.find('invoices', invoicenr='F003')[0]['remark'], 'new field')
+        self.assertRaises(factuursturen.FactuursturenWrongCall, mirror.find, 'invoices', nosuchfield=1)
+        self.assertListEqual(mirror.find('clients'), [])
+        mirror.close()
+
+    def test_refresh_default(self):
+        mirror = factuursturen.Mirror(self.filename)
+        fact = factuursturen.Client('foo', 'foo')
+        urls = []
+
+        def fake_get(url, **kwargs):
+            urls.append(url)
+            if url.endswith('/balance'):
+                return FakeResponse(content=json.dumps({'balance': '10.00'}))
+            return FakeResponse(content=json.dumps([]))
+
+        fact._session.get = fake_get
+        # balance returns a single object, so it is not mirrored
+        reports = mirror.refresh(fact)
+        self.assertNotIn('balance', reports)
+        self.assertNotIn(fact._url + 'balance', urls)
+        self.assertItemsEqual(reports, factuursturen.mirror.MIRRORKEYS)
+        mirror.close()
@@ -0,0 +1,66 @@
+from unittest import TestCase
+import factuursturen
+import json
+from helpers import FakeResponse
+
+
+class test_search(TestCase):
+    def setUp(self):
+        self.clients = [{'clientnr': 1, 'company': 'Johnny Bravo Inc.', 'contact': 'John Doe', 'city': 'Johnsville'},
+                        {'clientnr': 2, 'company': 'Bakkerij Brood', 'contact': 'Jan Jansen', 'city': 'Utrecht'},
+                        {'clientnr': 3, 'company': u'Caf\xe9 de Brug', 'contact': 'Piet Bravenboer',
+                         'city': 'Amsterdam'}]
+
+    def names(self, records):
+        return [record['clientnr'] for record in records]
+
+    def test_search(self):
+        index = factuursturen.SearchIndex('clients', self.clients)
+        self.assertEqual(len(index), 3)
+        # prefixes, as typed; a weaker match ranks lower
+        self.assertListEqual(self.names(index.search('bra')), [1, 3, 2])
+        self.assertListEqual(self.names(index.search('utr')), [2])
+        # accents and case are ignored, typos still match
+        self.assertListEqual(self.names(index.search('CAFE')), [3])
+        self.assertListEqual(self.names(index.search('jonny')), [1])
+        self.assertListEqual(self.names(index.search('bravo', limit=1)), [1])
+        self.assertListEqual(index.search('xyz'), [])
+        self.assertListEqual(index.search(' '), [])
+        self.assertRaises(factuursturen.FactuursturenWrongCall, factuursturen.SearchIndex, 'invoices')
+
+    def test_short_queries(self):
+        index = factuursturen.SearchIndex('clients', self.clients + [self.clients[0]])
+        # words starting with the letters typed, shortest text first
+        self.assertListEqual(self.names(index.search('b')), [2, 1, 3])
+        self.assertListEqual(self.names(index.search('J', limit=1)), [2])
+        self.assertListEqual(self.names(index.search('de')), [3])
+        self.assertListEqual(index.search('x'), [])
+        index.add({'clientnr': 4, 'company': 'Brood BV', 'contact': '', 'city': None})
+        self.assertListEqual(self.names(index.search('br')), [4, 2, 1, 3])
+        index.remove(2)
+        self.assertListEqual(self.names(index.search('br')), [4, 1, 3])
+        index.add(dict(self.clients[0], company='Johnny Inc.'))
+        self.assertListEqual(self.names(index.search('br')), [4, 3])
+
+    def test_update(self):
+        index = factuursturen.SearchIndex('clients', self.clients)
+        changed = [dict(self.clients[0], notes='not searched'),
+                   dict(self.clients[1], city='Rotterdam'),
+                   {'clientnr': 4, 'company': 'Utrecht Trading', 'contact': '', 'city': None}]
+        self.assertDictEqual(index.update(changed), {'inserted': 1, 'updated': 1, 'deleted': 1, 'unchanged': 1})
+        self.assertListEqual(self.names(index.search('utrecht')), [4])
+        self.assertListEqual(self.names(index.search('rotterdam')), [2])
+        self.assertListEqual(index.search('cafe'), [])
+        self.assertEqual(index.search('johnny')[0]['notes'], 'not searched')
+        # a cached search returns the object as it is now
+        index.update([dict(changed[0], notes='changed'), changed[1], changed[2]])
+        self.assertEqual(index.search('johnny')[0]['notes'], 'changed')
+
+    def test_refresh(self):
+        fact = factuursturen.Client('foo', 'foo')
+        fact._session.get = lambda *args, **kwargs: FakeResponse(content=json.dumps(
+            [{'id': '7', 'code': 'P-100', 'name': 'Hosting package', 'price': '10', 'taxes': '21'}]))
+        index = factuursturen.SearchIndex('products')
+        self.assertDictEqual(index.refresh(fact), {'inserted': 1, 'updated': 0, 'deleted': 0, 'unchanged': 0})
+        self.assertEqual(index.search('hostng')[0]['id'], 7)
+        self.assertEqual(index.search('p100')[0]['id'], 7)